@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import time
+
+# Cache size before the least recently used artifacts are evicted
+DEFAULT_CACHE_BYTES = 10 * 1024 * 1024 * 1024
+
+# Bookkeeping database kept in the root of the cache directory
+CACHE_INDEX_NAME = "artifacts.db"
+
+
+class ArtifactCache(object):
+    """
+    Content addressed store of compressed outputs, shared by every sync and server pointed at the same cache_dir.
+
+    Artifacts are keyed by the content of the source file and the compression settings (see artifact_path()), so a
+    file that moved, was renamed or shows up on another server is placed from the cache instead of being compressed
+    again.
+
+    The artifacts themselves are looked up, placed and stored by bzip_job() in the workers.  This class only keeps
+    track of their size and when they were last used, and evicts the least recently used ones once the cache grows
+    past max_bytes
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.pending = {}  # artifact path -> (size, last used)
+        self.stats = {"hit": 0, "stored": 0, "evicted": 0}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.cache_dir, CACHE_INDEX_NAME), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self.conn.commit()
+
+    def record(self, result):
+        """
+        Record the artifact a bzip_job() placed or stored as used now
+        :param result: The job's result dict
+        """
+        artifact = result.get("artifact")
+        if not artifact:
+            return
+        self.pending[artifact] = (result["bytes_out"], time.time())
+        self.stats[result["cache"]] += 1
+
+    def commit(self):
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO artifacts (path, size, last_used) VALUES (?, ?, ?)",
+                                  ((path,) + entry for path, entry in self.pending.items()))
+        self.pending = {}
+
+    def evict(self):
+        """
+        Write pending changes, then delete the least recently used artifacts until the cache fits in max_bytes.  An
+        output linked from an evicted artifact keeps its content
+        :return: List of the artifacts that were removed
+        """
+        self.commit()
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return []
+
+        removed = []
+        for path, size in self.conn.execute("SELECT path, size FROM artifacts ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed.append(path)
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM artifacts WHERE path = ?", ((path,) for path in removed))
+        self.stats["evicted"] += len(removed)
+        return removed
+
+    def close(self):
+        self.commit()
+        self.conn.close()
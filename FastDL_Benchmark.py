@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from FastDL_Sync_Core import SyncCore
+from FastDL_Sync_Index import INDEX_FILE_NAME
+from FastDL_Excludes import ExcludeMatcher
+from FastDL_Compression import bzip_job, copy_job
+
+# Content directories found in most Source game installs, with the file types that usually live in them
+GAME_DIRS = {
+    "maps": [".bsp", ".nav"],
+    "materials": [".vmt", ".vtf"],
+    "models": [".mdl", ".vvd", ".vtx", ".phy"],
+    "sound": [".wav", ".mp3"],
+    "resource": [".res", ".ttf"],
+    "lua": [".lua"],
+}
+
+WORDS = [b"brush", b"entity", b"origin", b"angles", b"model", b"texture", b"$basetexture", b"light", b"prop_static",
+         b"func_door", b"0 0 0", b"256", b"{", b"}", b"\n"]
+
+
+def build_file_data(size, entropy, rng):
+    """
+    Build file contents of the given size.  entropy is the fraction of the data that's random, the rest is text that
+    compresses well, so the mix controls the compression ratio
+    """
+    random_size = int(size * entropy)
+    text = bytearray()
+    while len(text) < size - random_size:
+        text += rng.choice(WORDS) + b" "
+    return os.urandom(random_size) + bytes(text[:size - random_size])
+
+
+def build_game_tree(root, file_count, min_size, max_size, large_files, large_size, entropy, seed):
+    """
+    Create a synthetic Source game tree below root.  File sizes follow a log uniform distribution between min_size and
+    max_size, plus a few large map files to model the long tail
+    :return: Total bytes written
+    """
+    rng = random.Random(seed)
+    total_bytes = 0
+
+    for i in range(file_count):
+        game_dir = rng.choice(list(GAME_DIRS))
+        ext = rng.choice(GAME_DIRS[game_dir])
+        directory = os.path.join(root, game_dir, "sub" + str(i % 50))
+        os.makedirs(directory, exist_ok=True)
+
+        size = int(min_size * (max_size / float(min_size)) ** rng.random())
+        with open(os.path.join(directory, "file" + str(i) + ext), "wb") as f:
+            f.write(build_file_data(size, entropy, rng))
+        total_bytes += size
+
+    os.makedirs(os.path.join(root, "maps"), exist_ok=True)
+    for i in range(large_files):
+        with open(os.path.join(root, "maps", "large" + str(i) + ".bsp"), "wb") as f:
+            f.write(build_file_data(large_size, entropy, rng))
+        total_bytes += large_size
+
+    return total_bytes
+
+
+def build_exclude_list(size, seed):
+    """
+    Synthetic exclude list mixing exact files, directories, extensions and globs
+    """
+    rng = random.Random(seed)
+    excludes = [".cache", ".log", "bin", "cfg\\valve.rc", "maps\\*_test.bsp", "resource\\sub1", ".ttf"]
+    while len(excludes) < size:
+        game_dir = rng.choice(list(GAME_DIRS))
+        excludes.append(game_dir + "\\sub" + str(rng.randint(50, 10000)) + "\\file" + str(rng.randint(0, 10 ** 6)) +
+                        rng.choice(GAME_DIRS[game_dir]))
+    return excludes
+
+
+def reset_peak_rss():
+    """
+    Start measuring peak RSS from now, so each stage reports its own peak and not the largest of everything before it.
+    ru_maxrss can't be reset, but on Linux the peak in /proc/self/status can.  Elsewhere peak RSS is reported as None
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Peak RSS since the last reset_peak_rss()
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0  # In kB
+    except OSError:
+        pass
+    return None
+
+
+def stage_result(name, elapsed, files, total_bytes, **extra):
+    result = {
+        "stage": name,
+        "seconds": round(elapsed, 4),
+        "files": files,
+        "files_per_second": round(files / elapsed, 1) if elapsed else None,
+        "mb_per_second": round(total_bytes / 1048576.0 / elapsed, 2) if elapsed and total_bytes else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+
+def bench_scan(source, dest, exclude_list, scan_workers):
+    # Start from an empty index so every file goes through the full check
+    for name in os.listdir(source):
+        if name.startswith(INDEX_FILE_NAME):
+            os.remove(os.path.join(source, name))
+
+    core = SyncCore(source, dest, True, exclude_list, scan_workers=scan_workers)
+    reset_peak_rss()
+    start = time.time()
+    files = core.scan()
+    elapsed = time.time() - start
+    core.sync_index.close()
+
+    return stage_result("scan", elapsed, core.scan_stats["files_scanned"], 0, queued=len(files),
+                        excludes=len(exclude_list), scan_threads=scan_workers), files
+
+
+def list_relative_paths(source):
+    relative_paths = []
+    for curdir, dirs, files in os.walk(source):
+        relative_dir = os.path.relpath(curdir, source).lower().replace(os.sep, "\\")
+        for f in files:
+            relative_paths.append(f.lower() if relative_dir == "." else relative_dir + "\\" + f.lower())
+    return relative_paths
+
+
+def bench_exclude(relative_paths, exclude_list):
+    reset_peak_rss()
+    start = time.time()
+    matcher = ExcludeMatcher(exclude_list)
+    excluded = sum(1 for path in relative_paths if matcher.is_excluded(path))
+    elapsed = time.time() - start
+
+    return stage_result("exclude", elapsed, len(relative_paths), 0, excludes=len(exclude_list), excluded=excluded)
+
+
+def bench_jobs(name, job, files, dest, threads):
+    """
+    Run a compress or copy job for every file on a thread pool and time it
+    """
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+
+    total_bytes = sum(file["size"] for file in files)
+    reset_peak_rss()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = []
+        for file in files:
+            output_file = os.path.join(dest, os.path.relpath(file["source"], file["root"]))
+            if job is bzip_job:
+                output_file += ".bz2"
+            futures.append(executor.submit(job, file["source"], output_file, os.path.dirname(output_file)))
+        for future in futures:
+            future.result()
+    elapsed = time.time() - start
+
+    bytes_out = 0
+    for curdir, dirs, outputs in os.walk(dest):
+        bytes_out += sum(os.path.getsize(os.path.join(curdir, f)) for f in outputs)
+
+    return stage_result(name, elapsed, len(files), total_bytes, threads=threads, bytes_in=total_bytes,
+                        bytes_out=bytes_out)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the scan, exclude, compress and copy stages of a sync")
+    parser.add_argument("--files", type=int, default=2000, help="Number of regular files in the synthetic tree")
+    parser.add_argument("--min-size", type=int, default=512, help="Smallest regular file in bytes")
+    parser.add_argument("--max-size", type=int, default=1024 * 1024, help="Largest regular file in bytes")
+    parser.add_argument("--large-files", type=int, default=2, help="Number of large map files")
+    parser.add_argument("--large-size", type=int, default=32 * 1024 * 1024, help="Size of each large map in bytes")
+    parser.add_argument("--entropy", type=float, default=0.3, help="Fraction of random (incompressible) data")
+    parser.add_argument("--excludes", type=int, nargs="+", default=[10, 1000], help="Exclude list sizes to test")
+    parser.add_argument("--scan-threads", type=int, nargs="+", default=[1, 8], help="Scan thread counts to test")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Thread counts to test")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="Directory to build the tree in, a temp directory by default")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="fastdl_bench_", dir=args.workdir)
+    source = os.path.join(workdir, "garrysmod")
+    dest = os.path.join(workdir, "fastdl")
+
+    try:
+        start = time.time()
+        total_bytes = build_game_tree(source, args.files, args.min_size, args.max_size, args.large_files,
+                                      args.large_size, args.entropy, args.seed)
+        results = {
+            "config": vars(args),
+            "tree": {"files": args.files + args.large_files, "bytes": total_bytes,
+                     "build_seconds": round(time.time() - start, 2)},
+            "stages": [],
+        }
+
+        files = []
+        relative_paths = list_relative_paths(source)
+        for size in args.excludes:
+            exclude_list = build_exclude_list(size, args.seed)
+            results["stages"].append(bench_exclude(relative_paths, exclude_list))
+            for scan_workers in args.scan_threads:
+                scan_result, files = bench_scan(source, dest, exclude_list, scan_workers)
+                results["stages"].append(scan_result)
+
+        for file in files:
+            file["root"] = source
+
+        for threads in args.threads:
+            results["stages"].append(bench_jobs("compress", bzip_job, files, dest, threads))
+            results["stages"].append(bench_jobs("copy", copy_job, files, dest, threads))
+
+        for stage in results["stages"]:
+            sys.stdout.write(json.dumps(stage) + "\n")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,721 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import bz2
+import errno
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows, reflinks aren't available
+
+from FastDL_Sync_Index import file_digest
+
+# Amount of data read from the source file and fed to the compressor at a time.  Keeps memory use per worker fixed
+# no matter how large the file being compressed is
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_COMPRESS_LEVEL = 5
+
+# Compression policy actions
+COMPRESS = "compress"
+STORE = "store"
+
+# Compressed output bigger than this fraction of the source isn't worth the client decompressing it.  The file is
+# stored raw instead
+DEFAULT_MAX_RATIO = 0.95
+
+# Jobs write to the output path plus this suffix and rename the file into place once it's complete, so clients never
+# download a partial file
+TEMP_SUFFIX = ".fastdl-tmp"
+
+# Linux ioctl that makes a copy on write clone of a file (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# How link_file() put a file in place, fastest first
+LINK_REFLINK = "reflink"
+LINK_HARDLINK = "hardlink"
+LINK_COPY_RANGE = "copy_file_range"
+LINK_COPY = "copy"
+
+# Suffixes of the two kinds of artifact kept in the artifact cache, see bzip_job()
+ARTIFACT_BZ2 = ".bz2"
+ARTIFACT_RAW = ".raw"
+
+# Outcomes of verify_job()
+VERIFY_OK = "ok"
+VERIFY_MISSING = "missing"  # The output isn't there
+VERIFY_CORRUPT = "corrupt"  # The .bz2 can't be decompressed, ex. it was truncated
+VERIFY_MISMATCH = "mismatch"  # The content doesn't match the source's recorded size or digest
+
+# Failed jobs are retried this many times when the error looks temporary, waiting DEFAULT_RETRY_DELAY seconds before
+# the first retry and twice as long before each one after that
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+
+# Errors that usually go away on their own: a file that's busy or locked, or a network share that hiccuped
+TRANSIENT_ERRNOS = set(getattr(errno, name) for name in ("EAGAIN", "EBUSY", "EINTR", "ETXTBSY", "ETIMEDOUT", "ESTALE")
+                       if hasattr(errno, name))
+
+# Windows sharing and lock violations, raised while another program (usually the game server) has the file open
+TRANSIENT_WINERRORS = (32, 33)
+
+# Extension -> (action, compresslevel).  Formats that are already compressed are stored raw, maps get the best level
+# since they're the biggest downloads, small text files get the fastest
+DEFAULT_POLICY_RULES = {
+    ".mp3": (STORE, None),
+    ".ogg": (STORE, None),
+    ".png": (STORE, None),
+    ".jpg": (STORE, None),
+    ".jpeg": (STORE, None),
+    ".gma": (COMPRESS, 9),
+    ".bsp": (COMPRESS, 9),
+    ".nav": (COMPRESS, 9),
+    ".vmt": (COMPRESS, 1),
+    ".txt": (COMPRESS, 1),
+}
+
+# Files larger than this are split into independent blocks and compressed on several workers when block mode is on
+DEFAULT_BLOCK_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class BlockPool(object):
+    """
+    Threads compressing blocks for every parallel_bzip_file() job in this process, and a cap of two blocks per thread
+    on the data they hold.  Jobs running at the same time share them, so threads and memory don't grow with the number
+    of jobs, and a big file left compressing on its own at the end of a sync gets every thread
+    """
+
+    current = None  # The pool new jobs use, see acquire()
+    shared_lock = threading.Lock()
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.Semaphore(workers * 2)
+        self.jobs = 0
+
+    @classmethod
+    def acquire(cls, workers):
+        """
+        The process' pool, for a job to use until it calls release().  When a job asks for a different number of
+        workers, ex. the thread count was changed, a new pool replaces it and the old one is shut down once the jobs
+        still using it are done.  Each process has its own
+        """
+        with cls.shared_lock:
+            if cls.current is None or cls.current.workers != workers:
+                previous, cls.current = cls.current, cls(workers)
+                if previous is not None and not previous.jobs:
+                    previous.executor.shutdown(wait=False)
+            cls.current.jobs += 1
+            return cls.current
+
+    @classmethod
+    def release(cls, pool):
+        with cls.shared_lock:
+            pool.jobs -= 1
+            if pool is not cls.current and not pool.jobs:
+                pool.executor.shutdown(wait=False)
+
+
+def new_timings():
+    """
+    Seconds a job spent in each stage.  Passed to the compress functions, which add to it as they go
+    """
+    return {"read_time": 0.0, "compress_time": 0.0, "write_time": 0.0}
+
+
+def bzip_file(input_file, output_file, compresslevel=DEFAULT_COMPRESS_LEVEL, chunk_size=DEFAULT_CHUNK_SIZE,
+              timings=None):
+    """
+    Stream the input file through a BZ2Compressor in fixed size chunks and write the result to the output file.
+
+    The output is byte for byte identical to bz2.open(output_file, "wb").write(data) at the same compresslevel
+    :param input_file: Path of the file to compress
+    :param output_file: Path of the .bz2 file to write
+    :param compresslevel: Bzip2 compression level 1-9
+    :param chunk_size: Number of bytes read from the source per iteration
+    :param timings: Optional dict from new_timings() that read, compress and write time is added to
+    :return: Tuple of (bytes read, bytes written)
+    """
+
+    compressor = bz2.BZ2Compressor(compresslevel)
+    bytes_in, bytes_out = 0, 0
+    read_time, compress_time, write_time = 0.0, 0.0, 0.0
+
+    with open(input_file, "rb") as source:
+        with open(output_file, "wb") as destination:
+            while True:
+                start = time.perf_counter()
+                chunk = source.read(chunk_size)
+                read_time += time.perf_counter() - start
+                if not chunk:
+                    break
+                bytes_in += len(chunk)
+
+                start = time.perf_counter()
+                data = compressor.compress(chunk)
+                compress_time += time.perf_counter() - start
+                if data:
+                    start = time.perf_counter()
+                    destination.write(data)
+                    write_time += time.perf_counter() - start
+                    bytes_out += len(data)
+
+            start = time.perf_counter()
+            data = compressor.flush()
+            compress_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            destination.write(data)
+            write_time += time.perf_counter() - start
+            bytes_out += len(data)
+
+    if timings is not None:
+        timings["read_time"] += read_time
+        timings["compress_time"] += compress_time
+        timings["write_time"] += write_time
+
+    return bytes_in, bytes_out
+
+
+def timed_compress(block, compresslevel):
+    """
+    Compress a single block and return the compressed data with the seconds it took
+    """
+    start = time.perf_counter()
+    data = bz2.compress(block, compresslevel)
+    return data, time.perf_counter() - start
+
+
+def parallel_bzip_file(input_file, output_file, workers, compresslevel=DEFAULT_COMPRESS_LEVEL,
+                       block_size=DEFAULT_BLOCK_SIZE, timings=None):
+    """
+    pbzip2 style compression for a single large file.  The file is cut into block_size pieces that are each compressed
+    as a complete bzip2 stream on a pool of threads (bz2 releases the GIL while compressing).  The streams are written
+    out in order, giving a multi-stream .bz2 that bzip2 and Python's bz2 module decompress to the original file.
+
+    The threads and block slots come from the process' BlockPool, shared with every other job splitting a file.  A job
+    that has blocks in flight writes out its oldest one instead of waiting for a slot, so jobs never wait on each other
+    for long.  The compress time recorded in timings is the sum over all blocks, so it can be larger than the wall time
+    of the job
+    :param input_file: Path of the file to compress
+    :param output_file: Path of the .bz2 file to write
+    :param workers: Size of the BlockPool to use
+    :param compresslevel: Bzip2 compression level 1-9
+    :param block_size: Size of each independently compressed block
+    :param timings: Optional dict from new_timings() that read, compress and write time is added to
+    :return: Tuple of (bytes read, bytes written)
+    """
+
+    bytes_in, bytes_out = 0, 0
+    if timings is None:
+        timings = new_timings()
+    pool = BlockPool.acquire(max(1, workers))
+    in_flight = deque()
+
+    def write_block(future):
+        try:
+            data, seconds = future.result()
+        finally:
+            pool.slots.release()
+        timings["compress_time"] += seconds
+        start = time.perf_counter()
+        destination.write(data)
+        timings["write_time"] += time.perf_counter() - start
+        return len(data)
+
+    try:
+        with open(input_file, "rb") as source:
+            with open(output_file, "wb") as destination:
+                while True:
+                    while not pool.slots.acquire(blocking=not in_flight):
+                        bytes_out += write_block(in_flight.popleft())
+
+                    start = time.perf_counter()
+                    try:
+                        block = source.read(block_size)
+                    except BaseException:
+                        pool.slots.release()
+                        raise
+                    timings["read_time"] += time.perf_counter() - start
+                    if not block:
+                        pool.slots.release()
+                        break
+                    bytes_in += len(block)
+                    in_flight.append(pool.executor.submit(timed_compress, block, compresslevel))
+
+                while in_flight:
+                    bytes_out += write_block(in_flight.popleft())
+
+                # An empty file still needs a valid (empty) bzip2 stream
+                if not bytes_in:
+                    data = bz2.compress(b"", compresslevel)
+                    destination.write(data)
+                    bytes_out += len(data)
+    finally:
+        # Blocks that were never written after an error give their slots back once they're done
+        for future in in_flight:
+            future.add_done_callback(lambda done: pool.slots.release())
+        BlockPool.release(pool)
+
+    return bytes_in, bytes_out
+
+
+def compress_file(input_file, output_file, compresslevel=DEFAULT_COMPRESS_LEVEL, chunk_size=DEFAULT_CHUNK_SIZE,
+                  block_workers=0, block_threshold=DEFAULT_BLOCK_THRESHOLD, block_size=DEFAULT_BLOCK_SIZE,
+                  timings=None):
+    """
+    Compress a file with the streaming compressor, or with parallel block compression when block_workers is set and
+    the file is larger than block_threshold
+    :return: Tuple of (bytes read, bytes written)
+    """
+    if block_workers > 1 and os.path.getsize(input_file) > block_threshold:
+        return parallel_bzip_file(input_file, output_file, block_workers, compresslevel=compresslevel,
+                                  block_size=block_size, timings=timings)
+
+    return bzip_file(input_file, output_file, compresslevel=compresslevel, chunk_size=chunk_size, timings=timings)
+
+
+def temp_path(output_file):
+    return output_file + TEMP_SUFFIX
+
+
+def remove_temp_file(output_file):
+    """
+    Remove the temp file a job left behind for output_file, if there is one.  Jobs call this before writing a temp
+    file too, as a stale one could be a hardlink to a source file that writing through it would overwrite
+    """
+    try:
+        os.remove(temp_path(output_file))
+    except FileNotFoundError:
+        pass
+
+
+def make_output_dir(output_dir):
+    """
+    Create the output directory if it doesn't exist yet.  Several workers can race to create the same directory so
+    we don't treat it already existing as an error
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+
+def artifact_path(cache_dir, digest, compresslevel, max_ratio):
+    """
+    Path of a compressed artifact in the cache, without the ARTIFACT_ suffix.  The key covers everything that changes
+    the output: the source content, the compression level and the raw fallback threshold
+    """
+    key = hashlib.blake2b((digest + ":" + str(compresslevel) + ":" + str(max_ratio)).encode("utf-8"),
+                          digest_size=20).hexdigest()
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def place_artifact(cache_file, input_file, output_file, started, timings):
+    """
+    Put a cached artifact at output_file, or at the raw fallback next to it if that's what was cached.  The artifact is
+    linked when the cache is on the same filesystem, see link_file()
+    :return: Job result dict, or None if nothing is cached
+    """
+    if os.path.isfile(cache_file + ARTIFACT_BZ2):
+        artifact = cache_file + ARTIFACT_BZ2
+    elif os.path.isfile(cache_file + ARTIFACT_RAW) and output_file.endswith(".bz2"):
+        artifact = cache_file + ARTIFACT_RAW
+        output_file = output_file[:-len(".bz2")]
+    else:
+        return None
+
+    start = time.perf_counter()
+    try:
+        remove_temp_file(output_file)
+        method = link_file(artifact, temp_path(output_file))
+        os.replace(temp_path(output_file), output_file)
+    except FileNotFoundError:
+        # Evicted by another sync between the check and the link
+        remove_temp_file(output_file)
+        return None
+    except BaseException:
+        remove_temp_file(output_file)
+        raise
+    timings["write_time"] += time.perf_counter() - start
+
+    result = job_result(output_file, os.path.getsize(input_file), os.path.getsize(output_file), started, timings)
+    result["method"] = method
+    result["cache"] = "hit"
+    result["artifact"] = artifact
+    return result
+
+
+def store_artifact(output_file, cache_file):
+    """
+    Add a finished output to the cache.  Goes through a temp file like the jobs, so a reader never sees a partial
+    artifact.  Jobs with the same content store the same artifact at the same time, so each gets a temp file of its
+    own and the last rename wins
+    :return: Path of the artifact
+    """
+    artifact = cache_file + (ARTIFACT_BZ2 if output_file.endswith(".bz2") else ARTIFACT_RAW)
+    make_output_dir(os.path.dirname(artifact))
+    fd, temp_file = tempfile.mkstemp(suffix=TEMP_SUFFIX, prefix=os.path.basename(artifact) + ".",
+                                     dir=os.path.dirname(artifact))
+    os.close(fd)
+    try:
+        os.remove(temp_file)  # link_file() wants the name free so it can hardlink
+        link_file(output_file, temp_file)
+        os.replace(temp_file, artifact)
+    except BaseException:
+        try:
+            os.remove(temp_file)
+        except FileNotFoundError:
+            pass
+        raise
+    return artifact
+
+
+def bzip_job(input_file, output_file, output_dir, compresslevel=DEFAULT_COMPRESS_LEVEL,
+             chunk_size=DEFAULT_CHUNK_SIZE, block_workers=0, max_ratio=None, cache_dir=None, digest=None,
+             refresh_cache=False):
+    """
+    Compress a single file as a self contained job.  This lives at module level so it can be pickled and sent to a
+    ProcessPoolExecutor worker, which doesn't need to import PyQt4 to run it.
+
+    If max_ratio is set and the file didn't shrink enough the .bz2 is thrown away and the file is stored raw next to
+    where it would have been.
+
+    The file is compressed to a temp file that's renamed over the output once it's complete.  Whatever was at the
+    output before stays in place until then.
+
+    With a cache_dir the output is looked up in the artifact cache by the content of the file first, and placed from
+    there without compressing when it's found.  Otherwise the new output is added to the cache
+    :param digest: Content digest of input_file if the caller already has it, see file_digest()
+    :param refresh_cache: Drop whatever is cached for the file and compress it again, ex. when verify found the output
+    linked from the cache corrupt
+    :return: Job result dict, see job_result().  With a cache_dir it also has the digest, whether the cache was hit or
+    the output stored, and the artifact's path
+    """
+    started = time.time()
+    timings = new_timings()
+    make_output_dir(output_dir)
+
+    cache_file = None
+    if cache_dir:
+        start = time.perf_counter()
+        if digest is None:
+            digest = file_digest(input_file)
+        timings["read_time"] += time.perf_counter() - start
+        cache_file = artifact_path(cache_dir, digest, compresslevel, max_ratio)
+        if refresh_cache:
+            for suffix in (ARTIFACT_BZ2, ARTIFACT_RAW):
+                try:
+                    os.remove(cache_file + suffix)
+                except FileNotFoundError:
+                    pass
+        result = place_artifact(cache_file, input_file, output_file, started, timings)
+        if result:
+            result["digest"] = digest
+            return result
+
+    try:
+        remove_temp_file(output_file)
+        bytes_in, bytes_out = compress_file(input_file, temp_path(output_file), compresslevel=compresslevel,
+                                            chunk_size=chunk_size, block_workers=block_workers, timings=timings)
+
+        start = time.perf_counter()
+        if max_ratio and bytes_in and bytes_out > bytes_in * max_ratio and output_file.endswith(".bz2"):
+            remove_temp_file(output_file)
+            output_file = output_file[:-len(".bz2")]
+            remove_temp_file(output_file)
+            shutil.copy2(input_file, temp_path(output_file))
+            bytes_out = bytes_in
+        os.replace(temp_path(output_file), output_file)
+        timings["write_time"] += time.perf_counter() - start
+    except BaseException:
+        remove_temp_file(output_file)
+        raise
+
+    result = job_result(output_file, bytes_in, bytes_out, started, timings)
+    if cache_file:
+        result["digest"] = digest
+        try:
+            result["artifact"] = store_artifact(output_file, cache_file)
+            result["cache"] = "stored"
+        except OSError:
+            # The output is in place, a full or read only cache shouldn't fail the sync
+            result["cache"] = "error"
+    return result
+
+
+def reflink_file(input_file, output_file):
+    with open(input_file, "rb") as source:
+        with open(output_file, "wb") as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def copy_file_range(input_file, output_file):
+    """
+    Copy a file inside the kernel.  Some filesystems (NFS 4.2, SMB, btrfs) do the copy server side or as a clone
+    """
+    with open(input_file, "rb") as source:
+        with open(output_file, "wb") as destination:
+            remaining = os.fstat(source.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+
+
+def link_file(input_file, output_file):
+    """
+    Put a file at output_file as cheaply as the filesystem allows.  Tries a reflink, then a hardlink, then
+    copy_file_range, then a normal copy (which uses sendfile on Linux).  Reflinks and hardlinks are only tried when
+    the source and output are on the same device.
+
+    A hardlinked output shares its inode, and so its content and mtime, with the source file
+    :return: The LINK_ method that worked
+    """
+    same_device = os.stat(input_file).st_dev == os.stat(os.path.dirname(output_file)).st_dev
+
+    if same_device:
+        if fcntl is not None:
+            try:
+                reflink_file(input_file, output_file)
+                shutil.copystat(input_file, output_file)
+                return LINK_REFLINK
+            except OSError:
+                os.remove(output_file)
+
+        try:
+            os.link(input_file, output_file)
+            return LINK_HARDLINK
+        except OSError:
+            pass
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            copy_file_range(input_file, output_file)
+            shutil.copystat(input_file, output_file)
+            return LINK_COPY_RANGE
+        except OSError:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    shutil.copy2(input_file, output_file)
+    return LINK_COPY
+
+
+def copy_job(input_file, output_file, output_dir, link=False):
+    """
+    Copy a single file to FastDL without compressing it.  Like bzip_job() the copy goes to a temp file that's renamed
+    into place.  The copy is a single call so all of its time is recorded as write time
+    :param link: Reflink or hardlink the file instead of copying it when possible, see link_file()
+    :return: Job result dict, see job_result().  method says how the file was copied
+    """
+    started = time.time()
+    timings = new_timings()
+    make_output_dir(output_dir)
+
+    start = time.perf_counter()
+    try:
+        remove_temp_file(output_file)
+        if link:
+            method = link_file(input_file, temp_path(output_file))
+        else:
+            shutil.copy2(input_file, temp_path(output_file))
+            method = LINK_COPY
+        os.replace(temp_path(output_file), output_file)
+    except BaseException:
+        remove_temp_file(output_file)
+        raise
+    timings["write_time"] += time.perf_counter() - start
+
+    size = os.path.getsize(output_file)
+    result = job_result(output_file, size, size, started, timings)
+    result["method"] = method
+    return result
+
+
+def verify_job(output_file, size, digest=None, source_file=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Check a FastDL output against the source it was synced from, without writing anything.  A .bz2 is decompressed
+    chunk_size bytes at a time and hashed as it goes, so memory stays flat whatever the size of the file.
+
+    Raw outputs take a fast path: their size is checked from a stat first, and they aren't read at all when there's no
+    digest to compare them to or they're hardlinked to the source
+    :param size: Size of the source recorded in the sync index
+    :param digest: Content digest recorded in the sync index.  Without one the output is compared to source_file's
+    :return: Dict with the output, the VERIFY_ status, the bytes read and a message saying what's wrong
+    """
+    result = {"output": output_file, "status": VERIFY_OK, "bytes": 0, "message": None}
+    compressed = output_file.endswith(".bz2")
+
+    try:
+        if not compressed:
+            output_size = os.path.getsize(output_file)
+            if output_size != size:
+                result["status"] = VERIFY_MISMATCH
+                result["message"] = "Size " + str(output_size) + ", expected " + str(size)
+                return result
+            if not digest and (not source_file or os.path.samefile(output_file, source_file)):
+                return result
+
+        hasher = hashlib.blake2b(digest_size=20)
+        with (bz2.open if compressed else open)(output_file, "rb") as output:
+            while True:
+                chunk = output.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                result["bytes"] += len(chunk)
+    except FileNotFoundError:
+        result["status"] = VERIFY_MISSING
+        return result
+    except (OSError, EOFError, ValueError) as e:
+        result["status"] = VERIFY_CORRUPT
+        result["message"] = str(e)
+        return result
+
+    if result["bytes"] != size:
+        result["status"] = VERIFY_MISMATCH
+        result["message"] = "Size " + str(result["bytes"]) + ", expected " + str(size)
+        return result
+
+    if not digest and source_file:
+        try:
+            digest = file_digest(source_file)
+        except OSError:
+            digest = None  # Source went away, the size will have to do
+    if digest and hasher.hexdigest() != digest:
+        result["status"] = VERIFY_MISMATCH
+        result["message"] = "Content differs from the source"
+    return result
+
+
+class SyncJobError(Exception):
+    """
+    Raised by run_job() when a job failed for good.  Everything is kept in args so it survives being sent back from a
+    ProcessPoolExecutor worker
+    """
+
+    def __init__(self, message, error_type, error_number=None, attempts=1, transient=False):
+        super(SyncJobError, self).__init__(message, error_type, error_number, attempts, transient)
+        self.message = message
+        self.error_type = error_type
+        self.error_number = error_number
+        self.attempts = attempts
+        self.transient = transient
+
+    def __str__(self):
+        return self.error_type + ": " + self.message
+
+
+def is_transient_error(error):
+    """
+    Check if an error is worth retrying
+    """
+    if not isinstance(error, OSError):
+        return False
+    if getattr(error, "winerror", None) in TRANSIENT_WINERRORS:
+        return True
+    return error.errno in TRANSIENT_ERRNOS
+
+
+def run_job(job, *args, **kwargs):
+    """
+    Run bzip_job() or copy_job(), retrying with exponential backoff while it fails with a transient error.  Lives at
+    module level so it can be sent to a ProcessPoolExecutor like the jobs themselves
+    :param retries: Keyword only.  Number of retries after the first attempt
+    :param retry_delay: Keyword only.  Seconds to wait before the first retry
+    :return: The job's result dict, with the number of attempts it took
+    :raises SyncJobError: When the job failed with an error that isn't transient, or ran out of retries
+    """
+    retries = kwargs.pop("retries", DEFAULT_RETRIES)
+    retry_delay = kwargs.pop("retry_delay", DEFAULT_RETRY_DELAY)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = job(*args, **kwargs)
+            result["attempts"] = attempt
+            return result
+        except Exception as e:
+            transient = is_transient_error(e)
+            if not transient or attempt > retries:
+                raise SyncJobError(str(e), type(e).__name__, getattr(e, "errno", None), attempt, transient)
+
+        # Jitter keeps workers that failed on the same locked file from retrying in lock step
+        time.sleep(retry_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+
+def job_result(output_file, bytes_in, bytes_out, started, timings):
+    """
+    What a job hands back to whoever ran it.  started and finished are wall clock times so they can be compared with
+    the time the file was queued, even when the job ran in another process
+    :param output_file: The output file that was actually written
+    """
+    result = dict(timings)
+    result.update({"output": output_file, "bytes_in": bytes_in, "bytes_out": bytes_out, "started": started,
+                   "finished": time.time()})
+    return result
+
+
+class CompressionPolicy(object):
+    """
+    Decides how each file type is handled when Bzip is enabled.  Rules are keyed by extension and either compress the
+    file at a given level or store it raw.  Extensions without a rule are compressed at the default level.
+
+    Compressed files are also checked against max_ratio and stored raw when compression barely helped
+    """
+
+    def __init__(self, rules=None, default_level=DEFAULT_COMPRESS_LEVEL, max_ratio=DEFAULT_MAX_RATIO):
+        self.rules = dict(DEFAULT_POLICY_RULES if rules is None else rules)
+        self.default_level = default_level
+        self.max_ratio = max_ratio
+        self.invalid_lines = []  # Lines load_compression_policy() couldn't read and skipped
+
+    def rule_for(self, path):
+        """
+        Return the (action, compresslevel) used for the given file
+        """
+        return self.rules.get(os.path.splitext(path)[1].lower(), (COMPRESS, self.default_level))
+
+    def is_stored(self, path):
+        return self.rule_for(path)[0] == STORE
+
+
+def load_compression_policy(policy_file, max_ratio=DEFAULT_MAX_RATIO):
+    """
+    Read a compression policy file.  One rule per line, an extension followed by "store" or a bzip2 level 1-9:
+        .mp3 store
+        .bsp 9
+    Rules in the file are added on top of the default rules.  Lines that aren't a valid rule are skipped and kept in
+    the policy's invalid_lines so the caller can report them
+    """
+    rules = dict(DEFAULT_POLICY_RULES)
+    invalid_lines = []
+    with open(policy_file, "r") as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            if len(parts) != 2:
+                invalid_lines.append(line.strip())
+                continue
+            ext, setting = parts[0].lower(), parts[1].lower()
+            if setting == STORE:
+                rules[ext] = (STORE, None)
+            elif setting.isdigit():
+                rules[ext] = (COMPRESS, max(1, min(9, int(setting))))
+            else:
+                invalid_lines.append(line.strip())
+
+    policy = CompressionPolicy(rules, max_ratio=max_ratio)
+    policy.invalid_lines = invalid_lines
+    return policy
@@ -0,0 +1,94 @@
+import fnmatch
+import os
+import re
+
+GLOB_CHARS = ("*", "?", "[")
+
+# Marks the end of an excluded directory in the prefix trie
+TRIE_END = "\\"
+
+
+class ExcludeMatcher(object):
+    """
+    Compiled form of an exclude list.
+
+    Exclude lists contain one entry per line using backslash separated paths relative to the game directory:
+        cfg\\valve.rc       Exact file
+        bin                 Directory.  Everything below it is excluded
+        .lua                Extension
+        maps\\*_test.bsp    Glob pattern matched against the whole relative path
+
+    Exact paths and extensions are set lookups and directories live in a prefix trie, so a lookup costs the same no
+    matter how long the exclude list gets.  Glob patterns are combined into a single regex
+    """
+
+    def __init__(self, exclude_list=None):
+        self.paths = set()
+        self.extensions = set()
+        self.trie = {}
+        self.glob = None
+
+        globs = []
+        for entry in exclude_list or []:
+            entry = entry.strip().lower().replace("/", "\\").strip("\\")
+            if not entry:
+                continue
+
+            if any(char in entry for char in GLOB_CHARS):
+                globs.append(fnmatch.translate(entry))
+            elif entry.startswith(".") and "\\" not in entry:
+                self.extensions.add(entry)
+            else:
+                # Could be a file or a directory, we can't tell from the list so it goes in both
+                self.paths.add(entry)
+                self.add_to_trie(entry)
+
+        if globs:
+            self.glob = re.compile("|".join("(?:" + pattern + ")" for pattern in globs))
+
+        self.count = len(self.paths) + len(self.extensions) + len(globs)
+
+    def __len__(self):
+        return self.count
+
+    def add_to_trie(self, entry):
+        node = self.trie
+        for part in entry.split("\\"):
+            node = node.setdefault(part, {})
+        node[TRIE_END] = True
+
+    def is_dir_excluded(self, relative_dir):
+        """
+        Check if a directory, or any directory above it, is excluded.  Used to prune whole subtrees during the walk
+        :param relative_dir: Backslash separated directory relative to the game directory
+        """
+        if not relative_dir:
+            return False
+
+        node = self.trie
+        for part in relative_dir.split("\\"):
+            node = node.get(part)
+            if node is None:
+                break
+            if TRIE_END in node:
+                return True
+
+        return bool(self.glob and self.glob.match(relative_dir))
+
+    def is_excluded(self, relative_path):
+        """
+        Check a file's path relative to the game directory against the exclude list
+        """
+        if relative_path in self.paths:
+            return True
+
+        relative_dir, _, name = relative_path.rpartition("\\")
+
+        ext = os.path.splitext(name)[1]
+        if ext and ext in self.extensions:
+            return True
+
+        if relative_dir and self.is_dir_excluded(relative_dir):
+            return True
+
+        return bool(self.glob and self.glob.match(relative_path))
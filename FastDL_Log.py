@@ -0,0 +1,106 @@
+from collections import deque
+from logging.handlers import RotatingFileHandler
+import html
+import logging
+
+# Lines kept for the GUI console.  Older lines are dropped once the buffer is full
+DEFAULT_MAX_LINES = 5000
+
+# Rotating log file settings
+DEFAULT_LOG_FILE_BYTES = 5 * 1024 * 1024
+DEFAULT_LOG_FILE_BACKUPS = 3
+
+# Verbosity levels offered in the GUI, lowest to highest
+LOG_LEVELS = [("Errors", logging.WARNING), ("Info", logging.INFO), ("Debug", logging.DEBUG)]
+
+
+class SyncLog(object):
+    """
+    Log model behind the GUI console.
+
+    Lines are written to a ring buffer instead of straight to the text box.  The GUI takes whatever is pending on a
+    timer and renders it in one go, so a sync that logs thousands of lines a second doesn't wait on Qt rendering them.
+    If more lines arrive between two flushes than the buffer holds, the oldest are skipped and counted.
+
+    Every line, whatever the verbosity, can also be written to a rotating log file
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, level=logging.INFO):
+        self.max_lines = max_lines
+        self.level = level
+        self.history = deque(maxlen=max_lines)  # Every line at any level, used to redraw when the level changes
+        self.pending = deque(maxlen=max_lines)  # Lines at or above the level that haven't been rendered yet
+        self.skipped = 0
+
+        self.logger = logging.getLogger("FastDL")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.file_handler = None
+
+    def write(self, line, level=logging.INFO, bold=None, color=None):
+        entry = (level, line, bold, color)
+        self.history.append(entry)
+
+        if self.file_handler:
+            self.logger.log(level, line)
+
+        if level < self.level:
+            return
+        if len(self.pending) == self.max_lines:
+            self.skipped += 1
+        self.pending.append(entry)
+
+    def take_pending(self):
+        """
+        Return the pending lines as HTML and clear them
+        """
+        lines = [self.format_html(entry) for entry in self.pending]
+        if self.skipped:
+            lines.insert(0, self.format_html((logging.WARNING, str(self.skipped) +
+                                              " Lines Skipped, The Log Is Falling Behind", True, "orange")))
+        self.pending.clear()
+        self.skipped = 0
+        return lines
+
+    def set_level(self, level):
+        """
+        Change the verbosity.  Returns the lines in the buffer at the new level as HTML so the console can be redrawn
+        """
+        self.level = level
+        self.pending.clear()
+        self.skipped = 0
+        return [self.format_html(entry) for entry in self.history if entry[0] >= level]
+
+    def enable_file(self, log_file, max_bytes=DEFAULT_LOG_FILE_BYTES, backup_count=DEFAULT_LOG_FILE_BACKUPS):
+        """
+        Also write every line to log_file, rolling it over once it reaches max_bytes
+        """
+        self.disable_file()
+        self.file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+        self.file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        self.logger.addHandler(self.file_handler)
+
+    def disable_file(self):
+        if self.file_handler:
+            self.logger.removeHandler(self.file_handler)
+            self.file_handler.close()
+            self.file_handler = None
+
+    @staticmethod
+    def format_html(entry):
+        level, line, bold, color = entry
+
+        output_string = ""
+        if bold:
+            output_string += "<strong>"
+        if color:
+            output_string += '<span style="color:' + color + ';">'
+
+        output_string += html.escape(line)
+
+        if color:
+            output_string += "</span>"
+        if bold:
+            output_string += "</strong>"
+
+        return output_string
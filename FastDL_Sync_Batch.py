@@ -0,0 +1,325 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+
+# Like the CLI, nothing here pulls in PyQt4
+from FastDL_Sync_Core import SyncCore, load_exclude_list, find_games, ENGINE_THREAD, ENGINE_PROCESS, ORDER_LARGEST, \
+    ORDER_SMALLEST, ORDER_WALK, SUPPORTED_GAMES
+from FastDL_Sync_Cli import ConsoleListener
+from FastDL_Compression import load_compression_policy, CompressionPolicy, DEFAULT_MAX_RATIO, DEFAULT_RETRIES, COMPRESS
+from FastDL_Artifact_Cache import ArtifactCache, DEFAULT_CACHE_BYTES
+
+
+class ServerListener(ConsoleListener):
+    """
+    ConsoleListener that tags every event with the server it came from
+    """
+
+    def __init__(self, server, json_output=False, stream=sys.stdout):
+        super(ServerListener, self).__init__(json_output=json_output, stream=stream)
+        self.server = server
+
+    def write_event(self, event, **fields):
+        fields["server"] = self.server
+        super(ServerListener, self).write_event(event, **fields)
+
+
+class BatchSync(object):
+    """
+    Sync several game servers to their FastDL directories from one process, on one shared worker pool.
+
+    Every server gets its own SyncCore, so it keeps its own index, exclude list, report and FastDL directory.  All of
+    them are scanned first, then their jobs are handed out round robin, each server's highest priority job first, so
+    one big server can't starve the others.
+
+    Servers of the same game share most of their content.  Files with the same content and the same compression
+    settings are only compressed once.  The other servers wait for that job and then copy, or with link_files
+    hardlink, its output into their own FastDL directory
+    """
+
+    def __init__(self, cores, engine=ENGINE_THREAD, workers=1):
+        self.cores = cores
+        self.engine = engine
+        self.workers = workers
+        self.in_flight = {}  # future -> (core, file)
+        self.followers = {}  # id of the file being compressed -> [(core, file)] waiting to reuse its output
+        self.turn = deque(cores)
+        self.cancelled = False
+        self.stats = {"servers": len(cores), "files_deduplicated": 0, "bytes_deduplicated": 0}
+
+    def run(self):
+        for core in self.cores:
+            if self.cancelled:
+                break
+            core.cleanup()
+            core.scan()
+
+        self.find_duplicates()
+
+        with self.create_executor() as executor:
+            for core in self.cores:
+                core.set_workers(self.workers)
+                for file in core.files_to_sync:
+                    if not file.get("duplicate"):
+                        core.queue.push(file)
+
+            self.dispatch_jobs(executor)
+            while self.in_flight:
+                done = wait(list(self.in_flight), return_when=FIRST_COMPLETED).done
+                for future in done:
+                    self.collect_job(future)
+                self.dispatch_jobs(executor)
+
+        # Left over when the job they were waiting on was dropped by a cancel
+        for followers in self.followers.values():
+            for core, file in followers:
+                core.sync_index.journal_finish(file["input"])
+
+        for core in self.cores:
+            if core.sync_index:
+                core.drop_queued_jobs()
+                core.finish_sync()
+
+        return self.stats
+
+    def cancel(self):
+        """
+        Stop the scans and drop the jobs that haven't started, see SyncCore.cancel()
+        """
+        self.cancelled = True
+        for core in self.cores:
+            core.cancel()
+
+    def create_executor(self):
+        if self.engine == ENGINE_PROCESS and any(core.bzip_enabled for core in self.cores):
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def job_key(self, core, file):
+        """
+        Files with the same key produce the same output.  Copies only need the same content, compressed files also need
+        the same level and raw fallback threshold
+        """
+        action, level = core.policy.rule_for(file["input"])
+        if core.bzip_enabled and action == COMPRESS:
+            return file["digest"], True, level, core.policy.max_ratio
+        return file["digest"], False, None, None
+
+    def find_duplicates(self):
+        """
+        Group the files to sync across every server by content.  Only files whose size matches a file on another server
+        are hashed, digests are cached in each server's index.  The first file of a group is compressed, the rest are
+        marked duplicate and wait for it in followers
+        """
+        by_size = {}
+        for core in self.cores:
+            for file in core.files_to_sync:
+                by_size.setdefault(file["size"], []).append((core, file))
+
+        leaders = {}
+        for files in by_size.values():
+            if len(set(id(core) for core, file in files)) < 2:
+                continue
+            for core, file in files:
+                if file["digest"] is None:
+                    try:
+                        file["digest"] = core.sync_index.get_digest(file["input"], file["size"], file["mtime"],
+                                                                    file["source"])
+                    except OSError:
+                        continue  # The job will report it
+                key = self.job_key(core, file)
+                leader = leaders.get(key)
+                if leader is None:
+                    leaders[key] = file
+                    continue
+                file["duplicate"] = True
+                self.followers.setdefault(id(leader), []).append((core, file))
+
+    def next_job(self):
+        """
+        Take the next server's highest priority job, skipping servers with nothing queued
+        :return: (core, file) or None if every queue is empty
+        """
+        for i in range(len(self.turn)):
+            core = self.turn[0]
+            self.turn.rotate(-1)
+            if core.queue and not core.cancelled:
+                return core, core.queue.pop()
+        return None
+
+    def dispatch_jobs(self, executor):
+        while len(self.in_flight) < self.workers:
+            job = self.next_job()
+            if job is None:
+                return
+            core, file = job
+            self.in_flight[core.start_job(executor, file)] = job
+
+    def collect_job(self, future):
+        """
+        Record a finished job with its server.  Files waiting on it are queued with their own server to copy its output,
+        or to do the job themselves if it failed
+        """
+        core, file = self.in_flight.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            core.collect_failure(file, e)
+            result = None
+        else:
+            if file.get("copy_from"):
+                self.stats["files_deduplicated"] += 1
+                self.stats["bytes_deduplicated"] += file["size"]
+                result["bytes_in"] = file["size"]  # The copy only read the compressed output
+            core.collect_result(file, result)
+        core.progress.job_finished()
+        core.listener.sync_thread_finished(file["input"])
+
+        for follower_core, follower in self.followers.pop(id(file), []):
+            if result:
+                follower["copy_from"] = result["output"]
+                follower["copy_to"] = follower["output"]
+                if follower["output"].endswith(".bz2") and not result["output"].endswith(".bz2"):
+                    # Compression didn't pay off, reuse the raw fallback
+                    follower["copy_to"] = follower["output"][:-len(".bz2")]
+            follower_core.queue.push(follower)
+
+
+def load_batch_file(batch_file):
+    """
+    Read the servers to sync from a JSON file holding a list of objects with these keys:
+
+    source: Game directory, or the server directory holding one or more supported games.  A directory named after a
+    supported game, or after game, is taken as the game directory even if it holds other games' mount folders
+    dest: FastDL directory.  When source holds more than one game each is synced to a directory named after the game
+    game: Optional.  Only sync this game from a server directory
+    exclude: Optional exclude list file.  Defaults to excludes/<game>.txt when it exists
+    name: Optional name used in the output.  Defaults to the source directory
+    :return: List of server dicts with name, source, dest, game and exclude
+    """
+    with open(batch_file, "r") as f:
+        entries = json.load(f)
+
+    servers = []
+    for entry in entries:
+        source = entry["source"]
+        name = os.path.basename(os.path.normpath(source))
+        if name == entry.get("game") or (not entry.get("game") and name in SUPPORTED_GAMES):
+            # Already a game directory.  A garrysmod directory can hold tf and cstrike mounts, they aren't servers
+            games = [(name, source)]
+        else:
+            games = find_games(source, [entry["game"]] if entry.get("game") else SUPPORTED_GAMES)
+        if not games:
+            # A game directory that isn't named after its game
+            games = [(entry.get("game") or name, source)]
+
+        for game, game_dir in games:
+            dest = entry["dest"]
+            if len(games) > 1:
+                dest = os.path.join(dest, game)
+            exclude = entry.get("exclude")
+            if not exclude:
+                default_exclude = os.path.join(os.path.dirname(os.path.abspath(__file__)), "excludes", game + ".txt")
+                exclude = default_exclude if os.path.isfile(default_exclude) else None
+            name = entry.get("name") or source
+            if len(games) > 1:
+                name += ":" + game
+            servers.append({"name": name, "source": game_dir, "dest": dest, "game": game, "exclude": exclude})
+
+    return servers
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sync many game servers to their FastDL directories on one shared "
+                                                 "worker pool.  Files shared between servers are compressed once")
+    parser.add_argument("batch", help="JSON file listing the servers, see load_batch_file()")
+    parser.add_argument("--no-bzip", dest="bzip", action="store_false", help="Copy files without compressing them")
+    parser.add_argument("--threads", type=int, default=multiprocessing.cpu_count(), help="Number of sync workers "
+                                                                                         "shared by every server")
+    parser.add_argument("--engine", choices=[ENGINE_THREAD, ENGINE_PROCESS], default=ENGINE_THREAD,
+                        help="Run compression in threads or processes")
+    parser.add_argument("--order", choices=[ORDER_LARGEST, ORDER_SMALLEST, ORDER_WALK], default=ORDER_LARGEST,
+                        help="Which files of each server to sync first")
+    parser.add_argument("--content-hash", action="store_true",
+                        help="Only resync files whose content changed, not just their modified time")
+    parser.add_argument("--policy", help="Compression policy file with per extension rules")
+    parser.add_argument("--max-ratio", type=float, default=DEFAULT_MAX_RATIO,
+                        help="Store files raw when compressed size is above this fraction of the original")
+    parser.add_argument("--link", action="store_true",
+                        help="Hardlink files shared between servers, and files that aren't compressed, instead of "
+                             "copying them")
+    parser.add_argument("--cache-dir", help="Keep compressed files in this directory and reuse them for any file with "
+                                            "the same content, across servers and batch runs")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Megabytes the cache may use before the least recently used files are evicted")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Times to retry a file that fails with a temporary error")
+    parser.add_argument("--json", action="store_true", help="Write progress as one JSON object per line")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if not os.path.isfile(args.batch):
+        sys.stderr.write("Batch file does not exist: " + args.batch + "\n")
+        return 1
+    servers = load_batch_file(args.batch)
+
+    if args.policy:
+        if not os.path.isfile(args.policy):
+            sys.stderr.write("Provided Compression Policy Is Not a Valid File: " + args.policy + "\n")
+            return 1
+        policy = load_compression_policy(args.policy, max_ratio=args.max_ratio)
+        for line in policy.invalid_lines:
+            sys.stderr.write("Skipped invalid compression rule: " + line + "\n")
+    else:
+        policy = CompressionPolicy(max_ratio=args.max_ratio)
+
+    artifact_cache = ArtifactCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    cores = []
+    listeners = []
+    synced = set()
+    for server in servers:
+        if not os.path.isdir(server["source"]):
+            sys.stderr.write("Source directory does not exist: " + server["source"] + "\n")
+            return 1
+        # Each source keeps an index per destination, the same pair twice would share one
+        pair = (os.path.normcase(os.path.abspath(server["source"])), os.path.normcase(os.path.abspath(server["dest"])))
+        if pair in synced:
+            sys.stderr.write("Source is synced to the same destination twice: " + server["source"] + " -> " +
+                             server["dest"] + "\n")
+            return 1
+        synced.add(pair)
+        exclude_list = load_exclude_list(server["exclude"]) if server["exclude"] else []
+        listener = ServerListener(server["name"], json_output=args.json)
+        listeners.append(listener)
+        cores.append(SyncCore(server["source"], server["dest"], args.bzip, exclude_list, listener=listener,
+                              hash_mode=args.content_hash, policy=policy, link_files=args.link, order=args.order,
+                              retries=args.retries, artifact_cache=artifact_cache))
+
+    batch = BatchSync(cores, engine=args.engine, workers=args.threads)
+
+    def cancel(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        batch.cancel()
+
+    signal.signal(signal.SIGINT, cancel)
+    stats = batch.run()
+
+    if args.json:
+        sys.stdout.write(json.dumps(dict(stats, event="batch_completed")) + "\n")
+    else:
+        sys.stdout.write("Batch completed: " + ", ".join(key + "=" + str(value) for key, value in stats.items()) + "\n")
+
+    return 2 if any(listener.failed for listener in listeners) else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
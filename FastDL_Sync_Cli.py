@@ -0,0 +1,243 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+# Don't import anything that pulls in PyQt4 here.  This is meant to start fast from cron
+from FastDL_Sync_Core import SyncCore, SyncListener, load_exclude_list, ENGINE_THREAD, ENGINE_PROCESS, \
+    ORDER_LARGEST, ORDER_SMALLEST, ORDER_WALK, SCAN_WORKERS
+from FastDL_Watcher import SyncWatcher, DEFAULT_DEBOUNCE
+from FastDL_Compression import load_compression_policy, CompressionPolicy, DEFAULT_MAX_RATIO, DEFAULT_RETRIES
+from FastDL_Artifact_Cache import ArtifactCache, DEFAULT_CACHE_BYTES
+
+
+class ConsoleListener(SyncListener):
+    """
+    Writes sync progress to stdout.  Either readable log lines or one JSON object per line for other tools to parse
+    """
+
+    def __init__(self, json_output=False, stream=sys.stdout):
+        self.json_output = json_output
+        self.stream = stream
+        self.total = 0
+        self.finished = 0
+        self.failed = 0
+
+    def write_event(self, event, **fields):
+        if self.json_output:
+            fields["event"] = event
+            fields["time"] = time.time()
+            self.stream.write(json.dumps(fields) + "\n")
+        else:
+            self.stream.write(event.replace("_", " ").capitalize() + ": " +
+                              ", ".join(str(value) for value in fields.values()) + "\n")
+        self.stream.flush()
+
+    def file_queued(self, input_file):
+        self.write_event("file_queued", file=input_file)
+
+    def newer_file_detected(self, input_file, rule):
+        self.write_event("newer_file_detected", file=input_file, rule=rule)
+
+    def file_removed(self, input_file, dry_run=False):
+        self.write_event("file_removed", file=input_file, dry_run=dry_run)
+
+    def stale_output_found(self, output_file, dry_run=False):
+        self.write_event("stale_output", file=output_file, dry_run=dry_run)
+
+    def cleanup_completed(self, stats):
+        if self.json_output:
+            self.write_event("cleanup_completed", **stats)
+        else:
+            self.write_event("cleanup_completed", stale_outputs=stats["stale_outputs"],
+                             delete_errors=len(stats["delete_errors"]), dry_run=stats["dry_run"])
+        for path, error in stats["delete_errors"]:
+            sys.stderr.write("Could not delete " + path + ": " + error + "\n")
+
+    def scan_completed(self, stats):
+        self.write_event("scan_completed", **stats)
+
+    def set_progress_max(self, count):
+        self.total = count
+        self.write_event("set_progress_max", total=count)
+
+    def sync_thread_started(self, message):
+        self.write_event("sync_thread_started", message=message)
+
+    def sync_thread_finished(self, message):
+        self.finished += 1
+        self.write_event("sync_thread_finished", file=message, finished=self.finished, total=self.total)
+
+    def file_synced(self, record):
+        # Already covered by sync_thread_finished in the readable output
+        if self.json_output:
+            self.write_event("file_synced", **record)
+
+    def file_failed(self, failure):
+        self.failed += 1
+        if self.json_output:
+            self.write_event("file_failed", **failure)
+        else:
+            self.write_event("file_failed", file=failure["file"], error=failure["error"] + ": " + failure["message"],
+                             attempts=failure["attempts"])
+
+    def verify_failed(self, result):
+        self.write_event("verify_failed", file=result["file"], output=result["output"], status=result["status"],
+                         message=result["message"])
+
+    def verify_completed(self, stats):
+        self.write_event("verify_completed", **stats)
+
+    def sync_report(self, summary):
+        if self.json_output:
+            self.write_event("sync_report", **summary)
+        else:
+            self.write_event("sync_report", files=summary["files_synced"], failed=summary["files_failed"],
+                             cache_hits=summary["cache_hits"], seconds=summary["wall_time"], mb_per_second=summary["mb_per_second"],
+                             ratio=summary["ratio"])
+
+    def sync_completed(self):
+        self.write_event("sync_completed", files_synced=self.total)
+        self.finished = 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sync a Source game server directory to a FastDL directory")
+    parser.add_argument("--source", help="Game directory to sync from, ex. /srv/gmod/garrysmod")
+    parser.add_argument("--dest", help="FastDL directory to sync to")
+    parser.add_argument("--no-bzip", dest="bzip", action="store_false", help="Copy files without compressing them")
+    parser.add_argument("--threads", type=int, default=multiprocessing.cpu_count(), help="Number of sync workers")
+    parser.add_argument("--scan-threads", type=int, default=SCAN_WORKERS,
+                        help="Number of threads listing source directories.  Raise it for network shares")
+    parser.add_argument("--engine", choices=[ENGINE_THREAD, ENGINE_PROCESS], default=ENGINE_THREAD,
+                        help="Run compression in threads or processes")
+    parser.add_argument("--exclude", help="Exclude list file")
+    parser.add_argument("--order", choices=[ORDER_LARGEST, ORDER_SMALLEST, ORDER_WALK], default=ORDER_LARGEST,
+                        help="Which files to sync first.  Changed files and maps always go ahead of the rest")
+    parser.add_argument("--split-large-files", action="store_true",
+                        help="Compress very large files as parallel blocks (multi-stream bzip2).  Clients that stop at "
+                             "the first bzip2 stream only get the first block, test a split map in game first")
+    parser.add_argument("--content-hash", action="store_true",
+                        help="Only resync files whose content changed, not just their modified time")
+    parser.add_argument("--policy", help="Compression policy file with per extension rules, ex. '.bsp 9' or "
+                                         "'.mp3 store'")
+    parser.add_argument("--max-ratio", type=float, default=DEFAULT_MAX_RATIO,
+                        help="Store files raw when compressed size is above this fraction of the original, 0 to "
+                             "always keep the .bz2")
+    parser.add_argument("--link", action="store_true",
+                        help="Reflink or hardlink files that aren't compressed instead of copying them.  Falls back to "
+                             "a copy when the destination is on another filesystem")
+    parser.add_argument("--cache-dir", help="Keep compressed files in this directory and reuse them for any file with "
+                                            "the same content, ex. after it was moved or on another server")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Megabytes the cache may use before the least recently used files are evicted")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Times to retry a file that fails with a temporary error, ex. it's locked by the server")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="List the stale and removed files that would be deleted from FastDL and the files that "
+                             "would be synced, with the total size and an estimate of how long it would take, without "
+                             "changing anything")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check every file on FastDL against its source, decompressing each .bz2 without writing "
+                             "it, and only resync the ones that are missing, corrupt or don't match")
+    parser.add_argument("--plan", help="Do a dry run and save everything the sync would do to this JSON file")
+    parser.add_argument("--apply", help="Run a plan saved with --plan as is.  The source, destination and sync type "
+                                        "come from the plan")
+    parser.add_argument("--json", action="store_true", help="Write progress as one JSON object per line")
+    parser.add_argument("--report", help="Write per file timings and a summary of each sync to this file.  CSV if it "
+                                         "ends in .csv, JSON otherwise")
+    parser.add_argument("--watch", action="store_true",
+                        help="After the initial sync keep running and sync files as soon as they change")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help="Seconds to wait for a burst of writes to settle in watch mode")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    plan = None
+    if args.apply:
+        if not os.path.isfile(args.apply):
+            sys.stderr.write("Provided Plan Is Not a Valid File: " + args.apply + "\n")
+            return 1
+        with open(args.apply, "r") as f:
+            plan = json.load(f)
+        args.source, args.dest, args.bzip = plan["source"], plan["dest"], plan["bzip"]
+        os.chdir(plan["working_dir"])
+    elif not args.source or not args.dest:
+        parser.error("--source and --dest are required unless a plan is applied")
+
+    if not os.path.isdir(args.source):
+        sys.stderr.write("Source directory does not exist: " + args.source + "\n")
+        return 1
+
+    exclude_list = []
+    if args.exclude:
+        if not os.path.isfile(args.exclude):
+            sys.stderr.write("Provided Exclude List Is Not a Valid File: " + args.exclude + "\n")
+            return 1
+        exclude_list = load_exclude_list(args.exclude)
+
+    if args.policy:
+        if not os.path.isfile(args.policy):
+            sys.stderr.write("Provided Compression Policy Is Not a Valid File: " + args.policy + "\n")
+            return 1
+        policy = load_compression_policy(args.policy, max_ratio=args.max_ratio)
+        for line in policy.invalid_lines:
+            sys.stderr.write("Skipped invalid compression rule: " + line + "\n")
+    else:
+        policy = CompressionPolicy(max_ratio=args.max_ratio)
+
+    listener = ConsoleListener(json_output=args.json)
+    artifact_cache = ArtifactCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+
+    block_workers = args.threads if args.split_large_files else 0
+    core = SyncCore(args.source, args.dest, args.bzip, exclude_list, listener=listener, block_workers=block_workers,
+                    hash_mode=args.content_hash, policy=policy, report_file=args.report, link_files=args.link,
+                    order=args.order, retries=args.retries, dry_run=args.dry_run,
+                    artifact_cache=artifact_cache, scan_workers=args.scan_threads)
+    watcher = None
+
+    if args.dry_run or args.plan:
+        # Files to sync are listed as file_queued events by the scan.  Nothing is written but the plan file
+        plan = core.plan()
+        if args.plan:
+            with open(args.plan, "w") as f:
+                json.dump(plan, f, indent=2)
+        listener.write_event("sync_plan", estimated_seconds=plan["estimated_seconds"],
+                             mb_per_second=plan["mb_per_second"], **plan["totals"])
+        return 0
+
+    def cancel(signum, frame):
+        # Let running jobs finish so nothing is left half written.  A second Ctrl+C stops straight away
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        listener.write_event("cancelling", message="Waiting for running jobs to finish")
+        core.cancel()
+        if watcher:
+            watcher.stop()
+
+    signal.signal(signal.SIGINT, cancel)
+    if plan:
+        core.apply_plan(plan, args.engine, args.threads)
+    elif args.verify:
+        core.verify(args.engine, args.threads)
+    else:
+        core.cleanup()
+        core.run_pipeline(args.engine, args.threads)
+
+    if args.watch and not core.cancelled:
+        watcher = SyncWatcher(core, engine=args.engine, workers=args.threads, debounce=args.debounce)
+        watcher.run()
+
+    # Files that failed are left out of the index and picked up by the next sync, let cron know something went wrong
+    return 2 if listener.failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,1371 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+import heapq
+import os
+import threading
+import time
+
+from FastDL_Excludes import ExcludeMatcher
+from FastDL_Sync_Index import SyncIndex, INDEX_FILE_NAME, load_fallback_outputs
+from FastDL_Compression import bzip_job, copy_job, run_job, verify_job, CompressionPolicy, COMPRESS, TEMP_SUFFIX, \
+    remove_temp_file, SyncJobError, DEFAULT_RETRIES, VERIFY_OK, VERIFY_MISSING, VERIFY_CORRUPT, VERIFY_MISMATCH
+from FastDL_Sync_Report import SyncReport, write_report
+
+# Everything needed to scan a source directory and sync it to FastDL, without any dependency on PyQt4.  The GUI and
+# the command line both drive a sync through SyncCore
+
+# Games we currently support.  A server's game directory is named after the game
+SUPPORTED_GAMES = ["garrysmod", "csgo", "tf"]
+
+# Available execution engines for compression jobs
+ENGINE_THREAD = "thread"
+ENGINE_PROCESS = "process"
+
+# Reasons reported with newer_file_detected
+RULE_MTIME = "mtime changed"
+RULE_SIZE = "size changed"
+RULE_CONTENT = "content changed"
+RULE_OUTPUT = "sync type or destination changed"
+
+# Minimum seconds between progress max updates while a scan is still finding files
+PROGRESS_INTERVAL = 0.25
+
+# Jobs allowed to wait in the pipeline before the scan blocks.  They're run in priority order, so this is also how far
+# ahead of the walk an urgent file can jump
+PENDING_JOBS = 10000
+
+# Most workers a sync can be resized to while it runs.  ProcessPoolExecutor can't go above this on Windows
+MAX_WORKERS = 61
+
+# Order jobs are run in.  In every order but walk, updates to files already on FastDL go first, then maps
+ORDER_LARGEST = "largest"  # Big files first so they don't end up as a long tail
+ORDER_SMALLEST = "smallest"  # Small files first so most files show up on FastDL as early as possible
+ORDER_WALK = "walk"  # The order the scan finds files in
+MAP_EXTENSIONS = (".bsp", ".nav", ".ain")
+
+# Minimum seconds between progress updates while jobs are running.  Keeps the GUI from being flooded when thousands of
+# small files finish every second
+PROGRESS_UPDATE_INTERVAL = 0.1
+
+# Seconds between writes of finished files to the sync index while a sync is running.  Bounds how much work is redone
+# after a crash
+INDEX_COMMIT_INTERVAL = 2.0
+
+# Threads listing source directories during a scan.  Listing is mostly waiting on the disk or network share, so it
+# scales well past the number of cores
+SCAN_WORKERS = 8
+
+# Threads used to delete stale outputs, and how many paths each one is handed at a time.  Deletes are mostly waiting on
+# the filesystem, so this is worth it even on a single core
+CLEANUP_WORKERS = 8
+CLEANUP_BATCH_SIZE = 256
+
+
+def load_exclude_list(exclude_file):
+    """
+    Read an exclude file into a list.  One path, file name or extension per line
+    """
+    exclude_list = []
+    with open(exclude_file, "r") as f:
+        for i in f:
+            exclude_list.append(i.strip("\n"))
+    return exclude_list
+
+
+def find_games(directory, supported_games=SUPPORTED_GAMES):
+    """
+    List the supported game directories directly below a server directory, ex. /srv/tf2 holds tf
+    :return: List of (game, game directory)
+    """
+    games = []
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return games
+    for entry in entries:
+        if entry.is_dir() and entry.name in supported_games:
+            games.append((entry.name, entry.path))
+    return games
+
+
+def list_dir(path):
+    """
+    List a directory for the scanner, on a worker thread.  File stat results are fetched here so they're cached on the
+    DirEntry before it's handed back.  On Windows they come with the listing, elsewhere it's a syscall per file
+    :return: List of DirEntry, or None if the directory can't be read
+    """
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return None
+
+    for entry in entries:
+        try:
+            if entry.is_file():
+                entry.stat()
+        except OSError:
+            pass  # Gone already, the scan skips it
+    return entries
+
+
+def find_stale_outputs(output_dir, bzip_enabled, policy=None, keep_files=None):
+    """
+    Walk the output directory with os.scandir and yield every file that doesn't match the current sync type (Bzip
+    on/off).
+
+    If the user selects to Bzip the files all files without the .bz2 ext are stale, except file types the compression
+    policy stores raw and the files in keep_files.
+
+    Temp files left by interrupted jobs are stale whatever the sync type
+    :param policy: CompressionPolicy used for the sync
+    :param keep_files: Raw files written by a Bzip sync, see SyncIndex.fallback_outputs()
+    """
+
+    stack = [output_dir]
+
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+                continue
+
+            name, ext = os.path.splitext(entry.name)
+            if ext == TEMP_SUFFIX:
+                yield entry.path
+                continue
+            if ext:
+                if bzip_enabled == (ext == ".bz2"):
+                    continue
+                if bzip_enabled and policy and policy.is_stored(entry.name):
+                    continue
+                if keep_files and entry.path in keep_files:
+                    continue
+                yield entry.path
+
+
+def in_directory(path, directory):
+    """
+    Check if a path is inside a directory, after resolving any .. in it
+    """
+    directory = os.path.join(os.path.normcase(os.path.abspath(directory)), "")
+    return os.path.normcase(os.path.abspath(path)).startswith(directory)
+
+
+def delete_files(paths, workers=CLEANUP_WORKERS, batch_size=CLEANUP_BATCH_SIZE, root=None):
+    """
+    Delete files on a thread pool, batch_size paths per task.  Files that are already gone are ignored
+    :param root: Only delete files inside this directory.  Anything outside it is reported as an error and left alone
+    :return: List of (path, error) for the files that couldn't be deleted
+    """
+
+    def delete_batch(batch):
+        errors = []
+        for path in batch:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append((path, e))
+        return errors
+
+    paths = list(paths)
+    outside = []
+    if root is not None:
+        outside = [(path, ValueError("Not inside " + root)) for path in paths if not in_directory(path, root)]
+        paths = [path for path in paths if in_directory(path, root)]
+
+    if len(paths) <= batch_size:
+        return outside + delete_batch(paths)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = executor.map(delete_batch, [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)])
+        return outside + [error for errors in batches for error in errors]
+
+
+def cleanup_opposite_sync_type(output_dir, bzip_enabled, on_delete=None, policy=None, keep_files=None, dry_run=False,
+                               workers=CLEANUP_WORKERS):
+    """
+    Cleanup Previously sync files that do not match the current sync type (Bzip on/off), see find_stale_outputs().
+
+    This is a potentially destructive method.  If fed a random directory without Bzip enabled it will delete everything
+    :param on_delete: Called with the path of each file before it's deleted
+    :param dry_run: Only find the files, don't delete them
+    :return: The stale files, and a list of (path, error) for the ones that couldn't be deleted
+    """
+
+    if not os.path.isdir(output_dir):
+        return [], []
+
+    stale_files = []
+    for path in find_stale_outputs(output_dir, bzip_enabled, policy=policy, keep_files=keep_files):
+        if on_delete:
+            on_delete(path)
+        stale_files.append(path)
+
+    if dry_run:
+        return stale_files, []
+    return stale_files, delete_files(stale_files, workers, root=output_dir)
+
+
+def job_priority(file, order=ORDER_LARGEST):
+    """
+    Priority of a sync job, higher runs first.  Fits in the int QThreadPool.start() takes
+    """
+    if order == ORDER_WALK:
+        return 0
+
+    rank = 0
+    if file.get("previous_output"):
+        rank += 2  # Clients may already be downloading the old version
+    if os.path.splitext(file["input"])[1] in MAP_EXTENSIONS:
+        rank += 1
+
+    size_class = file["size"].bit_length()
+    if order == ORDER_SMALLEST:
+        size_class = 64 - size_class
+    return rank * 100 + size_class
+
+
+class ProcessPool(object):
+    """
+    ProcessPoolExecutor that can grow while a sync runs.  A ProcessPoolExecutor starts all of its worker processes up
+    front, so the pool is sized for the workers the sync has and replaced by a bigger one when it's resized above that.
+    Jobs already handed to the old pool finish there before its processes exit
+    """
+
+    def __init__(self, workers):
+        self.size = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.retired = []
+
+    def resize(self, workers):
+        """
+        Make sure the pool has at least workers processes.  Shrinking is left to dispatch_jobs(), which hands out fewer
+        jobs at a time
+        """
+        if workers <= self.size:
+            return
+        self.executor.shutdown(wait=False)
+        self.retired.append(self.executor)
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.size = workers
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for executor in self.retired + [self.executor]:
+            executor.shutdown(wait=True)
+        return False
+
+
+class JobQueue(object):
+    """
+    Files waiting for a worker, popped highest job_priority() first.  Files with the same priority keep the order they
+    were pushed in
+    """
+
+    def __init__(self, order=ORDER_LARGEST):
+        self.order = order
+        self.heap = []
+        self.count = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, file):
+        heapq.heappush(self.heap, (-job_priority(file, self.order), self.count, file))
+        self.count += 1
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def clear(self):
+        files = [entry[2] for entry in self.heap]
+        self.heap = []
+        return files
+
+
+class SyncListener(object):
+    """
+    Receives progress from a SyncCore.  The method names match the signals ProcessSourceDir emits to the GUI.
+    Override the ones you care about
+    """
+
+    def file_queued(self, input_file):
+        pass
+
+    def newer_file_detected(self, input_file, rule):
+        pass
+
+    def file_removed(self, input_file, dry_run=False):
+        """
+        :param dry_run: True if the file's outputs are only listed, not deleted
+        """
+        pass
+
+    def stale_output_found(self, output_file, dry_run=False):
+        """
+        Called for every file cleanup() deletes, or would delete in a dry run
+        :param dry_run: True if the file is only listed, not deleted
+        """
+        pass
+
+    def cleanup_completed(self, stats):
+        """
+        :param stats: Dict with the stale_outputs found, the delete_errors as (path, message) and whether it was a
+        dry_run
+        """
+        pass
+
+    def scan_completed(self, stats):
+        """
+        :param stats: Dict with dirs_scanned, dirs_failed, files_scanned, dirs_pruned, files_excluded,
+        files_interrupted, files_recovered, files_removed and delete_errors counts
+        """
+        pass
+
+    def set_progress_max(self, count):
+        pass
+
+    def sync_thread_started(self, message):
+        pass
+
+    def sync_thread_finished(self, message):
+        pass
+
+    def progress_updated(self, finished, active):
+        """
+        Called at most every PROGRESS_UPDATE_INTERVAL seconds while jobs are running, and once more when the sync
+        finishes
+        :param finished: Number of jobs finished so far
+        :param active: Number of jobs currently running
+        """
+        pass
+
+    def file_synced(self, record):
+        """
+        :param record: Dict with the timings and byte counts of a finished file, see SyncReport.add_file()
+        """
+        pass
+
+    def file_failed(self, failure):
+        """
+        :param failure: Dict describing a file that couldn't be synced, see SyncCore.collect_failure()
+        """
+        pass
+
+    def verify_failed(self, result):
+        """
+        :param result: Dict describing an output that didn't pass SyncCore.verify(), see verify_job()
+        """
+        pass
+
+    def verify_completed(self, stats):
+        """
+        :param stats: Dict with files_verified, bytes_verified, a count for each way an output can fail and how many
+        files were queued to be synced again
+        """
+        pass
+
+    def sync_report(self, summary):
+        """
+        :param summary: Dict summarising the whole sync, see SyncReport.summary()
+        """
+        pass
+
+    def sync_completed(self):
+        pass
+
+
+class ProgressTracker(object):
+    """
+    Counts started and finished jobs.  Safe to call from any worker thread.
+
+    Instead of an event per file the counts are handed to on_update at a fixed rate, so the cost of reporting progress
+    doesn't grow with the number of files
+    """
+
+    def __init__(self, on_update, interval=PROGRESS_UPDATE_INTERVAL):
+        self.on_update = on_update
+        self.interval = interval
+        self.max_active = None  # Jobs beyond the number of workers are queued, not running
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = 0
+            self.finished = 0
+            self.last_update = 0.0
+
+    def job_started(self):
+        with self.lock:
+            self.started += 1
+            counts = self.due()
+        if counts:
+            self.on_update(*counts)
+
+    def job_finished(self):
+        with self.lock:
+            self.finished += 1
+            counts = self.due()
+        if counts:
+            self.on_update(*counts)
+
+    def due(self):
+        """
+        Return the (finished, active) counts if it's time for another update, otherwise None.  Call with the lock held
+        """
+        now = time.time()
+        if now - self.last_update < self.interval:
+            return None
+        self.last_update = now
+        return self.counts()
+
+    def counts(self):
+        active = self.started - self.finished
+        if self.max_active:
+            active = min(active, self.max_active)
+        return self.finished, active
+
+    def flush(self):
+        """
+        Report the final counts, whether or not an update is due
+        """
+        with self.lock:
+            self.last_update = time.time()
+            counts = self.counts()
+        self.on_update(*counts)
+
+
+class SyncCore(object):
+    """
+    Scan a game directory, work out what needs to be synced to FastDL and run the sync jobs.
+
+    A sync is scan() followed by running the jobs for files_to_sync, either through run_executor() or by the caller
+    (the GUI feeds them to its QThreadPool), then finish_sync() to record the results in the sync index.
+
+    run_pipeline() does both at once.  Files are handed to the workers as soon as the scan finds them.
+
+    Every finished job is timed and added to a SyncReport.  The summary is passed to the listener at the end of the
+    sync and written to report_file if one is set.
+
+    Queued files are written to the index journal and finished files are committed every INDEX_COMMIT_INTERVAL
+    seconds.  If a sync is interrupted the next one only redoes the files that hadn't finished, see resume_journal()
+
+    Jobs wait in a JobQueue and are handed to the executor highest priority first, no more than workers at a time.
+    pause(), resume(), cancel() and set_workers() can be called from any thread while a sync runs.
+
+    cleanup() deletes outputs left over from the other sync type before a sync starts.  With dry_run set cleanup() and
+    scan() only report what they would delete and sync, nothing is written.  plan() does a dry run and returns
+    everything the sync would do with an estimate of how long it would take, apply_plan() runs it later as is.
+
+    verify() checks the outputs already on FastDL against the index and only resyncs the ones that are missing,
+    corrupt or don't match their source.
+
+    With an artifact_cache, compressed outputs are kept in a content addressed cache and a file whose content was
+    compressed before with the same settings is placed from there instead of being compressed again.
+
+    Jobs that fail with a transient error (a locked or busy file) are retried up to retries times.  Files that still
+    fail are reported to the listener and the sync report and left out of the index, so the next sync tries them again
+    """
+
+    def __init__(self, input_dir, output_dir, bzip, exclude_list, listener=None, block_workers=0, hash_mode=False,
+                 policy=None, report_file=None, link_files=False, order=ORDER_LARGEST, retries=DEFAULT_RETRIES,
+                 dry_run=False, artifact_cache=None, scan_workers=SCAN_WORKERS):
+        # Absolute so the index keys and recorded outputs are the same whichever directory the sync is started from
+        self.input_directory = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.bzip_enabled = bzip
+        self.exclude_list = exclude_list
+        self.excludes = ExcludeMatcher(exclude_list)
+        self.listener = listener or SyncListener()
+        self.block_workers = block_workers  # Threads used to split large files into blocks, 0 to disable
+        self.hash_mode = hash_mode  # Only resync files whose content changed, not just their mtime
+        self.policy = policy or CompressionPolicy()
+        self.report_file = report_file  # .json or .csv file the sync report is written to
+        self.link_files = link_files  # Reflink or hardlink files that aren't compressed instead of copying them
+        self.retries = retries  # Times a job is retried after a transient error
+        self.dry_run = dry_run  # Report what would be deleted and synced without touching anything
+        self.artifact_cache = artifact_cache  # ArtifactCache shared with other syncs, None to always compress
+        self.scan_workers = scan_workers  # Threads listing directories during a scan, 1 to walk on the calling thread
+        self.stale_outputs = []  # Found by the last cleanup()
+        self.removed_files = []  # Files removed from the server found by the last scan, with their outputs
+        self.report = None
+        self.files_to_sync = []
+        self.sync_index = None
+        self.scan_stats = {}
+        self.on_file = None
+        self.queued_count = 0
+        self.last_progress = 0
+        self.last_commit = 0
+        self.in_flight = {}
+        self.progress = ProgressTracker(self.listener.progress_updated)
+
+        # Scheduling
+        self.order = order
+        self.queue = JobQueue(order)
+        self.workers = 1
+        self.resumed = threading.Event()  # Cleared while the sync is paused
+        self.resumed.set()
+        self.cancelled = False
+        self.control_lock = threading.Lock()
+        self.wakeup = Future()  # Completed to wake the dispatch loop when the controls change
+
+        # Lower case prefix stripped from input files to get the path relative to the game directory
+        self.input_prefix = os.path.join(self.input_directory.lower(), "")
+
+    def cleanup(self, workers=CLEANUP_WORKERS):
+        """
+        Delete the outputs that don't match the current sync type and any temp files left by interrupted jobs, in one
+        walk of the output directory.  Run it before the sync so the raw fallback outputs in the index are kept
+        :return: The stats passed to cleanup_completed()
+        """
+        keep_files = load_fallback_outputs(self.input_directory, self.output_dir) if self.bzip_enabled else None
+        stale_files, errors = cleanup_opposite_sync_type(self.output_dir, self.bzip_enabled,
+                                                         on_delete=self.stale_output_found,
+                                                         policy=self.policy, keep_files=keep_files,
+                                                         dry_run=self.dry_run, workers=workers)
+        self.stale_outputs = stale_files
+
+        stats = {
+            "stale_outputs": len(stale_files),
+            "delete_errors": [(path, str(error)) for path, error in errors],
+            "dry_run": self.dry_run,
+        }
+        self.listener.cleanup_completed(stats)
+        return stats
+
+    def stale_output_found(self, output_file):
+        self.listener.stale_output_found(output_file, self.dry_run)
+
+    def plan(self):
+        """
+        Work out what a sync would do without touching FastDL or the index: the files it would add and update, the stale
+        outputs and removed files it would delete, the bytes involved and an estimate of how long it would take based
+        on the throughput of recent syncs.  The plan can be saved as JSON and run later with apply_plan()
+        :return: Plan dict
+        """
+        dry_run = self.dry_run
+        self.dry_run = True
+        try:
+            self.cleanup()
+            files = self.scan()
+            throughput, measured_workers = self.sync_index.recent_throughput()
+            self.sync_index.close()
+            self.sync_index = None
+        finally:
+            self.dry_run = dry_run
+
+        bytes_to_sync = sum(file["size"] for file in files)
+        bytes_to_compress = sum(file["size"] for file in files if self.is_compressed(file))
+        adds = [file for file in files if not file["previous_output"]]
+        updates = [file for file in files if file["previous_output"]]
+
+        return {
+            "created": time.time(),
+            "working_dir": os.getcwd(),  # Source and destination can be relative
+            "source": self.input_directory,
+            "dest": self.output_dir,
+            "bzip": self.bzip_enabled,
+            "totals": {
+                "files_to_add": len(adds),
+                "files_to_update": len(updates),
+                "bytes_to_sync": bytes_to_sync,
+                "bytes_to_compress": bytes_to_compress,
+                "bytes_to_copy": bytes_to_sync - bytes_to_compress,
+                "stale_outputs": len(self.stale_outputs),
+                "removed_files": len(self.removed_files),
+            },
+            # Measured on whole syncs, scan included, with the workers they were run with
+            "mb_per_second": round(throughput / 1048576.0, 2) if throughput else None,
+            "measured_workers": measured_workers,
+            "estimated_seconds": round(bytes_to_sync / throughput, 1) if throughput else None,
+            "adds": adds,
+            "updates": updates,
+            "stale_outputs": list(self.stale_outputs),
+            "removed_files": list(self.removed_files),
+        }
+
+    def apply_plan(self, plan, engine=ENGINE_THREAD, workers=1):
+        """
+        Run a plan made by plan() as is, without walking either directory again.  Its stale outputs and removed files
+        are deleted and its adds and updates are synced.  A planned file that changed since is synced as it is now and
+        picked up again by the next sync, one that's gone is reported as failed
+        """
+        for path in plan["stale_outputs"]:
+            self.listener.stale_output_found(path)
+        errors = delete_files(plan["stale_outputs"], root=self.output_dir)
+        self.stale_outputs = list(plan["stale_outputs"])
+        self.listener.cleanup_completed({"stale_outputs": len(plan["stale_outputs"]),
+                                         "delete_errors": [(path, str(error)) for path, error in errors],
+                                         "dry_run": False})
+
+        self.open_index()
+        self.remove_indexed_files([removed["file"] for removed in plan["removed_files"]])
+        for file in plan["adds"] + plan["updates"]:
+            self.queue_file(dict(file))
+        self.listener.set_progress_max(self.queued_count)
+
+        self.run_executor(engine, workers)
+
+    def verify(self, engine=ENGINE_THREAD, workers=1):
+        """
+        Check every output in the sync index against the size and digest recorded for its source, see verify_job().
+        Outputs that are missing, corrupt or don't match are synced again straight after, nothing else is written.
+
+        The source is walked first to find which indexed files are still there.  No more than workers verify jobs are
+        handed out at a time, so memory stays flat however many files there are
+        :return: The stats passed to verify_completed()
+        """
+        self.open_index()
+        sources = {}
+        for entry in self.walk_source():
+            if self.cancelled:
+                break
+            try:
+                sources[entry.path.lower()] = (entry.path, entry.stat())
+            except OSError:
+                continue  # Removed while we were scanning
+
+        stats = {"files_verified": 0, "bytes_verified": 0, VERIFY_MISSING: 0, VERIFY_CORRUPT: 0, VERIFY_MISMATCH: 0,
+                 "requeued": 0}
+        self.set_workers(workers)
+        with self.create_executor(engine) as executor:
+            pending = {}
+            for input_file in list(self.sync_index.paths()):
+                if self.cancelled:
+                    break
+                size, mtime, output, digest, fallback = self.sync_index.get(input_file)
+                if not output:
+                    continue  # Imported from the old manifest, there's nothing recorded to check against
+
+                # Without a recorded digest the output is compared to the source, as long as it hasn't changed since
+                source_file = None
+                source = sources.get(input_file)
+                if not digest and source is not None and source[1].st_size == size and source[1].st_mtime == mtime:
+                    source_file = source[0]
+
+                pending[executor.submit(verify_job, output, size, digest=digest, source_file=source_file)] = input_file
+                while len(pending) >= self.workers:
+                    self.collect_verified(wait(list(pending), return_when=FIRST_COMPLETED).done, pending, sources,
+                                          stats)
+
+            while pending:
+                self.collect_verified(wait(list(pending), return_when=FIRST_COMPLETED).done, pending, sources, stats)
+
+        self.listener.verify_completed(stats)
+        self.listener.set_progress_max(self.queued_count)
+        if self.files_to_sync and not self.cancelled:
+            self.run_executor(engine, workers)
+        else:
+            self.finish_sync()
+        return stats
+
+    def collect_verified(self, done, pending, sources, stats):
+        """
+        Count finished verify jobs and queue the files whose output didn't pass
+        """
+        for future in done:
+            input_file = pending.pop(future)
+            result = future.result()
+            stats["files_verified"] += 1
+            stats["bytes_verified"] += result["bytes"]
+            if result["status"] == VERIFY_OK:
+                continue
+
+            stats[result["status"]] += 1
+            result["file"] = input_file
+            self.listener.verify_failed(result)
+
+            # Files that are gone from the server or excluded now are cleaned up by the next sync instead.  The rest
+            # skip the artifact cache, the bad output may be linked from it
+            source = sources.get(input_file)
+            if source is None:
+                continue
+            output_dir, output_file, relative_game_path = self.generate_output_paths(input_file)
+            if self.check_exclude_list(relative_game_path):
+                continue
+            source_path, stat = source
+            stats["requeued"] += 1
+            self.queue_file({"input": input_file, "source": source_path, "output": output_file,
+                             "output_dir": output_dir, "size": stat.st_size, "mtime": stat.st_mtime, "digest": None,
+                             "previous_output": self.sync_index.get(input_file)[2], "scan_time": 0.0,
+                             "refresh_cache": True})
+
+    def is_compressed(self, file):
+        action, level = self.policy.rule_for(file["input"])
+        return self.bzip_enabled and action == COMPRESS
+
+    def scan(self, on_file=None):
+        """
+        Walk the source directory and build the list of files that need syncing.  Files that were removed from the
+        server since the last sync are deleted from FastDL
+        :param on_file: If given each file that needs syncing is passed to it as soon as it's found instead of being
+        collected in files_to_sync.  The progress max is updated as the scan goes
+        :return: List of files to sync
+        """
+
+        self.open_index()
+        self.on_file = on_file
+        seen_files = set()
+        start = time.time()
+
+        for entry in self.walk_source():
+            if self.cancelled:
+                break
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Removed while we were scanning
+            input_file = self.check_file(entry.path, stat)
+            if input_file:
+                seen_files.add(input_file)
+
+        # A cancelled walk, or one that couldn't list every directory, didn't see everything, so we can't tell which
+        # files were removed
+        if not self.cancelled and not self.scan_stats["dirs_failed"]:
+            self.remove_deleted_files(seen_files)
+        self.report.scan_time = time.time() - start
+        self.on_file = None
+        self.listener.scan_completed(self.scan_stats)
+        self.listener.set_progress_max(self.queued_count)
+
+        return self.files_to_sync
+
+    def walk_source(self):
+        """
+        Walk the source directory with os.scandir and yield a DirEntry for every file.  Excluded directories are
+        dropped before we descend into them, so nothing below them is ever listed.
+
+        Directories are listed on scan_workers threads, so subtrees like maps, materials and models are read in
+        parallel, and files are yielded as soon as their directory has been listed.  The order files come out in
+        depends on which listing finishes first.
+
+        Counts of what was scanned and skipped are kept in scan_stats
+        """
+
+        if self.scan_workers <= 1:
+            stack = [(self.input_directory, "")]
+            while stack:
+                curdir, relative_dir = stack.pop()
+                for entry in self.walk_entries(list_dir(curdir), relative_dir, stack.append):
+                    yield entry
+            return
+
+        with ThreadPoolExecutor(max_workers=self.scan_workers) as executor:
+            pending = {}
+
+            def submit(job):
+                curdir, relative_dir = job
+                if not self.cancelled:
+                    pending[executor.submit(list_dir, curdir)] = relative_dir
+
+            submit((self.input_directory, ""))
+            while pending:
+                for future in wait(list(pending), return_when=FIRST_COMPLETED).done:
+                    relative_dir = pending.pop(future)
+                    for entry in self.walk_entries(future.result(), relative_dir, submit):
+                        yield entry
+
+    def walk_entries(self, entries, relative_dir, descend):
+        """
+        Sort the entries of one listed directory for walk_source().  Subdirectories that aren't excluded are passed to
+        descend as (path, relative path) and files are yielded.  A directory that couldn't be listed is counted in
+        dirs_failed
+        """
+        if entries is None:
+            self.scan_stats["dirs_failed"] += 1
+            return
+        self.scan_stats["dirs_scanned"] += 1
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                relative_path = self.join_game_path(relative_dir, entry.name)
+                if self.excludes.is_dir_excluded(relative_path):
+                    self.scan_stats["dirs_pruned"] += 1
+                    continue
+                descend((entry.path, relative_path))
+            elif entry.is_file():
+                self.scan_stats["files_scanned"] += 1
+                yield entry
+
+    def scan_paths(self, paths):
+        """
+        Only check the given source paths instead of walking the whole tree.  Used by watch mode to sync the files
+        a filesystem event was seen for.  Paths that no longer exist are deleted from FastDL, for a directory that's
+        every indexed file below it
+        :return: List of files to sync
+        """
+
+        self.open_index()
+        start = time.time()
+        gone = []
+
+        for source_path in sorted(paths):
+            if self.cancelled:
+                break
+            if os.path.isfile(source_path):
+                self.check_file(source_path)
+            elif self.sync_index.get(source_path.lower()) is not None:
+                self.remove_synced_file(source_path.lower())
+            elif not os.path.exists(source_path):
+                gone.append(os.path.join(source_path.lower(), ""))
+
+        # Could be directories that were moved out of the tree, their files don't get events of their own
+        if gone and not self.cancelled:
+            prefixes = tuple(gone)
+            for input_file in [path for path in self.sync_index.paths() if path.startswith(prefixes)]:
+                self.remove_synced_file(input_file)
+
+        self.report.scan_time = time.time() - start
+        self.listener.set_progress_max(self.queued_count)
+
+        return self.files_to_sync
+
+    def open_index(self):
+        self.files_to_sync = []
+        self.queued_count = 0
+        self.scan_stats = {"dirs_scanned": 0, "dirs_failed": 0, "files_scanned": 0, "dirs_pruned": 0,
+                           "files_excluded": 0, "files_interrupted": 0, "files_recovered": 0, "files_removed": 0,
+                           "delete_errors": 0}
+        self.sync_index = SyncIndex(self.input_directory, self.output_dir)
+        self.report = SyncReport()
+        self.removed_files = []
+        self.queue.clear()
+        self.progress.reset()
+        self.last_commit = time.time()
+        if not self.dry_run:
+            self.resume_journal()
+
+    def resume_journal(self):
+        """
+        Clean up after a sync that was interrupted.  Every file still in the journal was queued but never recorded as
+        synced.
+
+        Jobs only rename their output into place once it's complete, so an output written after the file was queued
+        means the job finished and only the index update was lost.  Those files are recorded as synced now.  For the
+        rest the temp file is removed and the scan queues them again like any other changed file
+        """
+        entries = self.sync_index.journal_entries()
+        if not entries:
+            return
+
+        for path, size, mtime, output, digest, queued in entries:
+            self.scan_stats["files_interrupted"] += 1
+            written = None
+            for candidate in (output, output[:-len(".bz2")] if output.endswith(".bz2") else None):
+                if candidate:
+                    remove_temp_file(candidate)
+                    if not written and self.written_since(candidate, queued):
+                        written = candidate
+
+            if written:
+                self.scan_stats["files_recovered"] += 1
+                self.sync_index.mark_synced(path, size, mtime, written, digest, fallback=written != output)
+            else:
+                self.sync_index.journal_finish(path)
+
+        self.sync_index.commit()
+
+    @staticmethod
+    def written_since(output_file, since):
+        """
+        Check if a file was put in place after the given time.  Raw outputs keep the source's mtime, but renaming
+        them into place updates their ctime (creation time on Windows)
+        """
+        try:
+            stat = os.stat(output_file)
+        except FileNotFoundError:
+            return False
+        return max(stat.st_mtime, stat.st_ctime) >= since
+
+    def check_file(self, source_path, stat=None):
+        """
+        Check a single source file against the sync index and queue it if it needs syncing
+        :param stat: Stat result for the file if the caller already has it, ex. from a DirEntry
+        :return: The input file if it's part of the sync, None if it's excluded
+        """
+
+        if os.path.basename(source_path).startswith(INDEX_FILE_NAME):
+            return None
+
+        start = time.perf_counter()
+        input_file = source_path.lower()
+
+        output_dir, output_file, relative_game_path = self.generate_output_paths(input_file)
+
+        if self.check_exclude_list(relative_game_path):
+            self.scan_stats["files_excluded"] += 1
+            return None
+
+        if stat is None:
+            stat = os.stat(source_path)
+
+        if self.sync_index.is_current(input_file, stat.st_size, stat.st_mtime, output_file):
+            return input_file
+
+        digest = None
+        if self.hash_mode:
+            digest = self.sync_index.get_digest(input_file, stat.st_size, stat.st_mtime, source_path)
+
+        entry = self.sync_index.get(input_file)
+
+        # The old output keeps being served until the job renames the new one over it, or removes it once done if
+        # the new one is written somewhere else
+        previous_output = None
+        if entry is None or entry[2] is None:
+            # Not in the index yet (first run or imported from the old manifest).  Fall back to comparing
+            # against what's already in the FastDL directory, with a single stat
+            try:
+                output_mtime = os.stat(output_file).st_mtime
+            except OSError:
+                output_mtime = None
+            if output_mtime is not None:
+                if not stat.st_mtime > output_mtime:
+                    self.sync_index.mark_synced(input_file, stat.st_size, stat.st_mtime, output_file, digest)
+                    return input_file
+                previous_output = output_file
+                self.listener.newer_file_detected(input_file, RULE_MTIME)
+        else:
+            rule = self.change_rule(entry, stat, output_file, digest)
+            if not rule:
+                # Only the stat data changed, the content is the same as what's already on FastDL
+                self.sync_index.mark_synced(input_file, stat.st_size, stat.st_mtime, output_file, digest)
+                return input_file
+            previous_output = entry[2]
+            self.listener.newer_file_detected(input_file, rule)
+
+        self.queue_file({"input": input_file, "source": source_path, "output": output_file, "output_dir": output_dir,
+                         "size": stat.st_size, "mtime": stat.st_mtime, "digest": digest,
+                         "previous_output": previous_output, "scan_time": time.perf_counter() - start})
+
+        return input_file
+
+    def queue_file(self, file):
+        self.queued_count += 1
+        self.listener.file_queued(file["input"])
+
+        now = time.time()
+        file["queued"] = now  # Wall clock time so queue wait can be worked out against a job in another process
+        if not self.dry_run:
+            self.sync_index.journal_start(file["input"], file["size"], file["mtime"], file["output"], file["digest"],
+                                          now)
+
+        if self.on_file is None:
+            self.files_to_sync.append(file)
+            return
+
+        if now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.listener.set_progress_max(self.queued_count)
+
+        self.on_file(file)
+
+    def run_executor(self, engine=ENGINE_THREAD, workers=1):
+        """
+        Run the queued sync jobs in a concurrent.futures pool.  The process engine sidesteps the GIL so compression
+        scales with the number of cores.  Copies are I/O bound so they always run on threads.
+
+        Jobs are reported as started when they're submitted and as finished when their future completes
+        """
+
+        self.set_workers(workers)
+        with self.create_executor(engine) as executor:
+            for file in self.files_to_sync:
+                self.queue.push(file)
+            self.drain_jobs(executor)
+
+        self.finish_sync()
+
+    def run_pipeline(self, engine=ENGINE_THREAD, workers=1, queue_size=PENDING_JOBS):
+        """
+        Scan and sync at the same time.  Each file is queued as soon as the scan finds it, so the first files are
+        being compressed while the rest of the tree is still being walked.
+
+        At most queue_size jobs wait in the queue.  When it's full the scan waits for a job to finish, which keeps
+        memory flat no matter how many files need syncing
+        """
+
+        self.set_workers(workers)
+        with self.create_executor(engine) as executor:
+            def submit(file):
+                self.queue.push(file)
+                self.dispatch_jobs(executor)
+                while len(self.queue) >= queue_size and not self.cancelled:
+                    self.wait_for_jobs(executor)
+
+            self.scan(on_file=submit)
+            self.drain_jobs(executor)
+
+        self.finish_sync()
+
+    def create_executor(self, engine):
+        """
+        The thread pool is sized for MAX_WORKERS so the sync can be resized while it runs.  Threads are only started as
+        jobs are handed out, and dispatch_jobs() never hands out more than workers at a time.  Worker processes all
+        start with their pool, so that's sized for workers and grown by dispatch_jobs() when needed, see ProcessPool
+        """
+        if self.bzip_enabled and engine == ENGINE_PROCESS:
+            return ProcessPool(self.workers)
+        return ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+    def pause(self):
+        """
+        Stop handing out jobs.  Jobs that are already running finish
+        """
+        self.resumed.clear()
+        self.wake()
+
+    def resume(self):
+        self.resumed.set()
+        self.wake()
+
+    def cancel(self):
+        """
+        Stop the scan and drop every job that hasn't started.  Jobs that are already running finish, so nothing is
+        left half written.  The dropped files are picked up by the next sync
+        """
+        self.cancelled = True
+        self.resumed.set()
+        self.wake()
+
+    def set_workers(self, workers):
+        """
+        Change how many jobs run at once.  Takes effect straight away when growing and as running jobs finish when
+        shrinking
+        """
+        self.workers = max(1, min(workers, MAX_WORKERS))
+        self.progress.max_active = self.workers
+        self.wake()
+
+    def wake(self):
+        with self.control_lock:
+            if not self.wakeup.done():
+                self.wakeup.set_result(None)
+
+    def wait_to_run(self):
+        """
+        Called by a worker before it starts a job.  Blocks while the sync is paused
+        :return: False if the sync was cancelled and the job shouldn't run
+        """
+        self.resumed.wait()
+        return not self.cancelled
+
+    def dispatch_jobs(self, executor):
+        """
+        Submit the highest priority queued jobs until every worker is busy
+        """
+        if isinstance(executor, ProcessPool):
+            executor.resize(self.workers)
+        while self.queue and len(self.in_flight) < self.workers and self.resumed.is_set() and not self.cancelled:
+            self.submit_job(executor, self.queue.pop())
+
+    def next_wakeup(self):
+        """
+        Future completed by the next wake().  Take it before checking what to wait for, so a wake in between isn't lost
+        """
+        with self.control_lock:
+            if self.wakeup.done():
+                self.wakeup = Future()
+            return self.wakeup
+
+    def wait_for_jobs(self, executor):
+        """
+        Block until a job finishes or the controls change, then collect finished jobs and hand out more
+        """
+        wakeup = self.next_wakeup()
+        done = wait(list(self.in_flight) + [wakeup], return_when=FIRST_COMPLETED).done
+        done.discard(wakeup)
+        self.collect_jobs(done)
+
+        if self.cancelled:
+            self.drop_queued_jobs()
+        self.dispatch_jobs(executor)
+
+    def drop_queued_jobs(self):
+        """
+        Throw away the jobs that haven't started after a cancel.  They're taken out of the journal as nothing was
+        written for them, the next scan finds they still need syncing
+        """
+        for file in self.queue.clear():
+            self.sync_index.journal_finish(file["input"])
+
+    def submit_job(self, executor, file):
+        self.in_flight[self.start_job(executor, file)] = file
+
+    def start_job(self, executor, file):
+        """
+        Submit the job for a single file and count it as started.
+
+        A file with copy_from set has the same content as a file another sync already wrote (see BatchSync), so its
+        output is copied or linked from there instead of being compressed again
+        :return: The job's future
+        """
+        action, level = self.policy.rule_for(file["input"])
+        if file.get("copy_from"):
+            self.listener.sync_thread_started("Reusing: " + os.path.basename(file["input"]))
+            future = executor.submit(run_job, copy_job, file["copy_from"], file["copy_to"], file["output_dir"],
+                                     link=self.link_files, retries=self.retries)
+        elif self.bzip_enabled and action == COMPRESS:
+            self.listener.sync_thread_started("Compressing: " + os.path.basename(file["input"]))
+            future = executor.submit(run_job, bzip_job, file["source"], file["output"], file["output_dir"],
+                                     compresslevel=level, block_workers=self.job_block_workers(executor),
+                                     max_ratio=self.policy.max_ratio, cache_dir=self.cache_dir(),
+                                     digest=file["digest"], refresh_cache=file.get("refresh_cache", False),
+                                     retries=self.retries)
+        else:
+            self.listener.sync_thread_started("Moving: " + os.path.basename(file["input"]))
+            future = executor.submit(run_job, copy_job, file["source"], file["output"], file["output_dir"],
+                                     link=self.link_files, retries=self.retries)
+        self.progress.job_started()
+        return future
+
+    def job_block_workers(self, executor):
+        """
+        Block threads for a job that splits a large file.  Jobs in one process share a BlockPool, but every worker
+        process has its own, so with processes block_workers is split between them
+        """
+        if self.block_workers > 1 and isinstance(executor, (ProcessPool, ProcessPoolExecutor)):
+            return max(2, self.block_workers // self.workers)
+        return self.block_workers
+
+    def drain_jobs(self, executor):
+        """
+        Run the jobs left in the queue and wait for all of them to finish
+        """
+        self.dispatch_jobs(executor)
+        while self.in_flight or (self.queue and not self.cancelled):
+            self.wait_for_jobs(executor)
+        if self.cancelled:
+            self.drop_queued_jobs()
+
+    def collect_jobs(self, done):
+        """
+        Record finished jobs in the sync index and report them to the listener
+        """
+        for future in done:
+            file = self.in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.collect_failure(file, e)
+            else:
+                self.collect_result(file, result)
+            self.progress.job_finished()
+            self.listener.sync_thread_finished(file["input"])
+
+    def collect_result(self, file, result):
+        """
+        Record a finished job in the sync index and the sync report
+        :param result: The result dict returned by bzip_job() or copy_job()
+        """
+        file["synced_output"] = result["output"]
+        if result.get("digest") and not file["digest"]:
+            # Hashed by the job for the artifact cache, keep it so content hash mode doesn't read the file again
+            file["digest"] = result["digest"]
+        if self.artifact_cache:
+            self.artifact_cache.record(result)
+        self.mark_file_synced(file)
+        if file.get("previous_output") and file["previous_output"] != result["output"]:
+            # Left alone by remove_output() if it's outside the FastDL directory, ex. the destination was changed
+            self.remove_output(file["previous_output"])
+        self.listener.file_synced(self.report.add_file(file, result))
+
+        if time.time() - self.last_commit >= INDEX_COMMIT_INTERVAL:
+            self.last_commit = time.time()
+            self.sync_index.commit()
+
+    def cache_dir(self):
+        return self.artifact_cache.cache_dir if self.artifact_cache else None
+
+    def collect_failure(self, file, error):
+        """
+        Record a job that failed.  The file isn't marked synced, any output it had from an earlier sync is left alone
+        and it's taken out of the journal, so the next scan picks it up again
+        :param error: The exception the job raised.  A SyncJobError from run_job() says how many attempts were made
+        :return: The failure dict passed to the listener
+        """
+        if not isinstance(error, SyncJobError):
+            # Something went wrong outside the job itself, ex. a process pool worker died
+            error = SyncJobError(str(error), type(error).__name__, getattr(error, "errno", None))
+
+        failure = {
+            "file": file["input"],
+            "ext": os.path.splitext(file["input"])[1],
+            "error": error.error_type,
+            "message": error.message,
+            "errno": error.error_number,
+            "attempts": error.attempts,
+            "transient": error.transient,
+        }
+        self.sync_index.journal_finish(file["input"])
+        self.report.add_failure(failure)
+        self.listener.file_failed(failure)
+        return failure
+
+    def finish_sync(self):
+        """
+        Write the sync index, write the sync report and let the listener know we're done.  Jobs record their files in
+        the index as they finish, see collect_result()
+        """
+        self.progress.flush()
+        summary = self.report.summary(self.scan_stats)
+
+        # Throughput history for plan() estimates
+        if summary["bytes_in"]:
+            self.sync_index.record_sync(summary["finished"], summary["files_synced"], summary["bytes_in"],
+                                        summary["wall_time"], self.workers)
+        self.sync_index.commit()
+        self.sync_index.close()
+        self.sync_index = None
+        if self.artifact_cache:
+            self.artifact_cache.evict()
+
+        if self.report_file:
+            write_report(self.report_file, summary, self.report.records)
+        self.listener.sync_report(summary)
+
+        self.listener.sync_completed()
+
+    def mark_file_synced(self, file):
+        """
+        Record a finished file in the sync index.  synced_output is where the job actually wrote it, which is the raw
+        file instead of the .bz2 when compression didn't pay off
+        """
+        output = file.get("synced_output") or file["output"]
+        self.sync_index.mark_synced(file["input"], file["size"], file["mtime"], output, file["digest"],
+                                    fallback=output != file["output"])
+
+    def change_rule(self, entry, stat, output_file, digest):
+        """
+        Work out why an indexed file needs to be synced again.  Returns None if it doesn't, which only happens in
+        content hash mode when the stat data changed but the content didn't
+        :param entry: The (size, mtime, output, digest, fallback) recorded in the sync index
+        """
+        if not self.sync_index.output_matches(entry, output_file):
+            return RULE_OUTPUT
+        if self.hash_mode and entry[3]:
+            if entry[3] == digest:
+                return None
+            return RULE_CONTENT
+        if entry[0] != stat.st_size:
+            return RULE_SIZE
+        return RULE_MTIME
+
+    def remove_deleted_files(self, seen_files):
+        """
+        Any file in the sync index that wasn't seen during the walk has been removed from the server.  Entries imported
+        from the old manifest may not use the same path as the walk, so those only count as removed once the file is
+        really gone.  The rest are just dropped from the index
+        """
+        removed = []
+        for input_file in self.sync_index.paths():
+            if input_file in seen_files:
+                continue
+            if self.sync_index.get(input_file)[2] is None and os.path.isfile(input_file):
+                if not self.dry_run:
+                    self.sync_index.remove(input_file)
+                continue
+            removed.append(input_file)
+        self.remove_indexed_files(removed)
+
+    def remove_indexed_files(self, input_files):
+        """
+        Drop files that were removed from the server from the index and delete their outputs from FastDL, all in one
+        batch on the cleanup thread pool.  In a dry run they're only listed in removed_files
+        """
+        outputs = []
+        for input_file in input_files:
+            if self.sync_index.get(input_file) is None:
+                continue  # Already dropped, ex. by another sync since a plan was made
+            file_outputs = self.synced_outputs(input_file)
+            self.listener.file_removed(input_file, self.dry_run)
+            self.scan_stats["files_removed"] += 1
+            self.removed_files.append({"file": input_file, "outputs": file_outputs})
+            outputs.extend(file_outputs)
+            if not self.dry_run:
+                self.sync_index.remove(input_file)
+
+        if outputs and not self.dry_run:
+            self.scan_stats["delete_errors"] += len(delete_files(outputs, root=self.output_dir))
+
+    def remove_synced_file(self, input_file):
+        """
+        Delete a file that was removed from the server from FastDL and drop it from the index
+        """
+        self.listener.file_removed(input_file, self.dry_run)
+        self.scan_stats["files_removed"] += 1
+        if self.dry_run:
+            return
+        for output_file in self.synced_outputs(input_file):
+            self.remove_output(output_file)
+        self.sync_index.remove(input_file)
+
+    def synced_outputs(self, input_file):
+        """
+        The outputs an indexed file was synced to
+        """
+        output_file = self.sync_index.get(input_file)[2]
+        if output_file:
+            return [output_file]
+        # Imported from the old manifest so we don't know which sync type wrote it.  Remove both
+        try:
+            output_dir = self.generate_output_paths(input_file)[0]
+        except ValueError:
+            return []  # Not from this source directory, there's nothing of ours to remove
+        raw_file = os.path.join(output_dir, os.path.basename(input_file))
+        return [raw_file, raw_file + ".bz2"]
+
+    def remove_output(self, output_file):
+        if not in_directory(output_file, self.output_dir):
+            return
+        try:
+            os.remove(output_file)
+        except FileNotFoundError:
+            pass
+
+    def generate_output_paths(self, input_file):
+        """
+        Generate the relative and full output paths.  Return the output directory, the absolute output path and
+        relative game directory.
+
+        The relative game path always uses backslashes so it matches the exclude lists on every platform
+        :param input_file:
+        :return:
+        :raises ValueError: If the input file isn't inside the source directory
+        """
+
+        if not input_file.startswith(self.input_prefix):
+            raise ValueError("Not inside the source directory: " + input_file)
+        relative_path = input_file[len(self.input_prefix):]  # Strip everything except game directories
+
+        temp = os.path.join(self.output_dir, relative_path)
+        output_dir = os.path.dirname(temp)
+        output_file = os.path.join(output_dir, os.path.basename(input_file))
+
+        if self.bzip_enabled and not self.policy.is_stored(input_file):
+            output_file += ".bz2"
+
+        return output_dir, output_file, relative_path.replace(os.sep, "\\")
+
+    def join_game_path(self, relative_dir, name):
+        if relative_dir:
+            return relative_dir + "\\" + name.lower()
+        return name.lower()
+
+    def check_exclude_list(self, to_be_checked):
+        """
+        Check if given file, or relative path is in exclude list.  This covers exact paths, extensions, any excluded
+        parent directory and glob patterns
+        """
+        return self.excludes.is_excluded(to_be_checked)
@@ -1,35 +1,72 @@
 from PyQt4 import QtGui
-from PyQt4.QtCore import QMutex, SIGNAL, QThreadPool
+from PyQt4.QtCore import SIGNAL, QThreadPool, QTimer
+import logging
+import multiprocessing
 import sys
 import design
 import os
 
 from FastDL_Thread_Classes import ProcessSourceDir
+from FastDL_Sync_Core import load_exclude_list, ENGINE_THREAD, ENGINE_PROCESS, ORDER_LARGEST, ORDER_SMALLEST, \
+    ORDER_WALK, SUPPORTED_GAMES
+from FastDL_Compression import CompressionPolicy, load_compression_policy
+from FastDL_Log import SyncLog, LOG_LEVELS
+from FastDL_Artifact_Cache import ArtifactCache
 
 # TODO Set exlcude list on auto detected game
 # TODO selected_game_changed gets called twice on init for some reason
 # something
 
+# Milliseconds between redraws of the console
+LOG_FLUSH_INTERVAL = 200
+
+# Job orders offered in the GUI
+SYNC_ORDERS = [("Largest First", ORDER_LARGEST), ("Smallest First", ORDER_SMALLEST), ("Walk Order", ORDER_WALK)]
+
+
 class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
     def __init__(self):
 
         super(self.__class__, self).__init__()
         self.setupUi(self)
 
+        # Console lines are buffered in the log and drawn in batches by the timer.  The text box only keeps as many
+        # lines as the log's ring buffer
+        self.log = SyncLog()
+        self.mainTextWindow.document().setMaximumBlockCount(self.log.max_lines)
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_gui_console)
+        self.log_timer.start(LOG_FLUSH_INTERVAL)
+
         # Games we currently support
-        self.supported_games = ["garrysmod", "csgo", "tf"]
+        self.supported_games = list(SUPPORTED_GAMES)
         self.set_support_games()
 
-        self.fastdl_manifest = []  # Stores All Files We Have Synced
         self.exclude_list = []  # List of excludes loaded from exludes.txt
+
+        # Per file type compression settings.  Defaults can be extended with CWD\compression.txt
+        self.compression_policy = CompressionPolicy()
+        policy_file = os.path.join(os.getcwd(), "compression.txt")
+        if os.path.isfile(policy_file):
+            self.compression_policy = load_compression_policy(policy_file)
+            for line in self.compression_policy.invalid_lines:
+                self.write_to_gui_console("Skipped Invalid Compression Rule In compression.txt: " + line,
+                                          level=logging.WARNING)
+
+        # Timings for the last sync are written to CWD\sync_report.json
+        self.report_file = os.path.join(os.getcwd(), "sync_report.json")
         self.total_files_to_sync = 0
 
+        # Compressed outputs are cached in CWD\artifact_cache when Cache Artifacts is checked
+        self.artifact_cache_dir = os.path.join(os.getcwd(), "artifact_cache")
+        self.artifact_cache = None
+
         self.failed_file_sync = []
 
         # Threading Stuff
         self.pool = QThreadPool()
-        self.thread_lock = QMutex()
         self.pool.setMaxThreadCount(self.syncThreads.value())
+        self.main_sync_thread = None
 
         # Allow the Text Box To Auto Scroll
         self.text_virtical_scroll = self.mainTextWindow.verticalScrollBar()
@@ -48,11 +85,158 @@ class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
 
         self.set_exlude_list(self.excludeListDisplay.text())
 
+        self.setup_extra_sync_settings()
+
+    def setup_extra_sync_settings(self):
+        """
+        Add the settings that aren't part of the generated design to the Sync Settings box.
+
+        Engine: Threads use the QThreadPool, Processes send compression jobs to a process pool so they aren't limited
+        by the GIL.
+        Split Large Files: Compress files over the block threshold as parallel blocks.
+        Content Hash: Compare file hashes when a file's stat data changes before resyncing it
+        Order: Which files are synced first.  Changed files and maps always go ahead of the rest
+        Pause / Cancel: Control a running sync.  Jobs that already started finish either way
+        Link Files: Reflink or hardlink files that aren't compressed instead of copying them, when FastDL is on the
+        same filesystem as the game
+        Plan: Work out what a sync would add, update and delete and how long it would take, without changing anything
+        Cache Artifacts: Keep compressed files in CWD\artifact_cache and reuse them for files with the same content
+        Log Level: How much detail is shown in the console.  Debug shows every queued and started file
+        Log To File: Also write every line to CWD\fastdl_sync.log, rotated as it grows
+        """
+        self.engineLabel = QtGui.QLabel("Engine", self.groupBox_2)
+        self.gridLayout_4.addWidget(self.engineLabel, 0, 7, 1, 1)
+
+        self.engineCombo = QtGui.QComboBox(self.groupBox_2)
+        self.engineCombo.addItem("Threads")
+        self.engineCombo.addItem("Processes")
+        self.gridLayout_4.addWidget(self.engineCombo, 0, 8, 1, 1)
+
+        self.splitLargeFiles = QtGui.QCheckBox("Split Large Files", self.groupBox_2)
+        self.splitLargeFiles.setToolTip("Compress very large files as parallel blocks (multi-stream bzip2).  Warning: "
+                                        "clients that stop at the first bzip2 stream only get the first 8 MB, test a "
+                                        "split map in game before relying on it")
+        self.splitLargeFiles.toggled.connect(self.split_large_files_changed)
+        self.gridLayout_4.addWidget(self.splitLargeFiles, 0, 9, 1, 1)
+
+        self.contentHash = QtGui.QCheckBox("Content Hash", self.groupBox_2)
+        self.contentHash.setToolTip("Only resync files whose content changed, not just their modified time")
+        self.gridLayout_4.addWidget(self.contentHash, 0, 10, 1, 1)
+
+        self.linkFiles = QtGui.QCheckBox("Link Files", self.groupBox_2)
+        self.linkFiles.setToolTip("Reflink or hardlink files that aren't compressed instead of copying them.  Falls back "
+                                  "to a copy when FastDL is on another drive")
+        self.gridLayout_4.addWidget(self.linkFiles, 0, 11, 1, 1)
+
+        self.logLevelLabel = QtGui.QLabel("Log Level", self.groupBox_2)
+        self.gridLayout_4.addWidget(self.logLevelLabel, 1, 0, 1, 1)
+
+        self.logLevelCombo = QtGui.QComboBox(self.groupBox_2)
+        for name, level in LOG_LEVELS:
+            self.logLevelCombo.addItem(name)
+        self.logLevelCombo.setCurrentIndex([level for name, level in LOG_LEVELS].index(self.log.level))
+        self.logLevelCombo.currentIndexChanged.connect(self.log_level_changed)
+        self.gridLayout_4.addWidget(self.logLevelCombo, 1, 1, 1, 1)
+
+        self.logToFile = QtGui.QCheckBox("Log To File", self.groupBox_2)
+        self.logToFile.setToolTip("Write every log line to fastdl_sync.log in the working directory")
+        self.logToFile.toggled.connect(self.log_to_file_changed)
+        self.gridLayout_4.addWidget(self.logToFile, 1, 2, 1, 1)
+
+        self.orderLabel = QtGui.QLabel("Order", self.groupBox_2)
+        self.gridLayout_4.addWidget(self.orderLabel, 1, 3, 1, 1)
+
+        self.orderCombo = QtGui.QComboBox(self.groupBox_2)
+        for name, order in SYNC_ORDERS:
+            self.orderCombo.addItem(name)
+        self.gridLayout_4.addWidget(self.orderCombo, 1, 4, 1, 1)
+
+        self.pauseSync = QtGui.QPushButton("Pause", self.groupBox_2)
+        self.pauseSync.setCheckable(True)
+        self.pauseSync.setDisabled(True)
+        self.pauseSync.toggled.connect(self.pause_sync_toggled)
+        self.gridLayout_4.addWidget(self.pauseSync, 1, 5, 1, 1)
+
+        self.cancelSync = QtGui.QPushButton("Cancel", self.groupBox_2)
+        self.cancelSync.setDisabled(True)
+        self.cancelSync.clicked.connect(self.cancel_sync)
+        self.gridLayout_4.addWidget(self.cancelSync, 1, 6, 1, 1)
+
+        self.planSync = QtGui.QPushButton("Plan", self.groupBox_2)
+        self.planSync.setToolTip("Show what a sync would do and estimate how long it would take, without changing "
+                                 "anything")
+        self.planSync.clicked.connect(self.plan_sync)
+        self.gridLayout_4.addWidget(self.planSync, 1, 8, 1, 1)
+
+        self.cacheArtifacts = QtGui.QCheckBox("Cache Artifacts", self.groupBox_2)
+        self.cacheArtifacts.setToolTip("Reuse compressed files for content that was compressed before, ex. after it "
+                                       "was moved or on another server")
+        self.gridLayout_4.addWidget(self.cacheArtifacts, 1, 7, 1, 1)
+
+    def pause_sync_toggled(self, paused):
+        self.pauseSync.setText("Resume" if paused else "Pause")
+        # The button is disabled when it's reset between syncs
+        if not self.main_sync_thread or not self.pauseSync.isEnabled():
+            return
+        if paused:
+            self.main_sync_thread.core.pause()
+            self.write_to_gui_console("Sync Paused.  Running Jobs Will Finish", bold=True)
+        else:
+            self.main_sync_thread.core.resume()
+            self.write_to_gui_console("Sync Resumed", bold=True)
+
+    def cancel_sync(self):
+        if not self.main_sync_thread:
+            return
+        self.cancelSync.setDisabled(True)
+        self.pauseSync.setDisabled(True)
+        self.main_sync_thread.core.cancel()
+        self.write_to_gui_console("Cancelling Sync.  Waiting For Running Jobs To Finish", bold=True, color="orange")
+
+    def log_level_changed(self):
+        """
+        Redraw the console at the new verbosity from the lines still in the log's buffer
+        """
+        lines = self.log.set_level(LOG_LEVELS[self.logLevelCombo.currentIndex()][1])
+        self.mainTextWindow.clear()
+        self.append_gui_console(lines)
+
+    def log_to_file_changed(self, checked):
+        if checked:
+            self.log.enable_file(os.path.join(os.getcwd(), "fastdl_sync.log"))
+        else:
+            self.log.disable_file()
+
+    def split_large_files_changed(self, checked):
+        if checked:
+            self.write_to_gui_console("Split Large Files Writes Multi-Stream Bzip2.  Not Every Client Reads Past The "
+                                      "First Stream, Test A Split Map In Game Before Relying On It", color="orange",
+                                      level=logging.WARNING)
+
+    def selected_engine(self):
+        """
+        Return the engine currently picked in the engine drop down
+        """
+        if self.engineCombo.currentIndex() == 1:
+            return ENGINE_PROCESS
+        return ENGINE_THREAD
+
+    def selected_block_workers(self):
+        """
+        Number of threads to split large files across.  0 disables block compression
+        """
+        if self.splitLargeFiles.isChecked():
+            return self.syncThreads.value()
+        return 0
+
     def sync_threads_changed(self):
         """
-        Run when the user changes the number of sync threads to use in the GUI
+        Run when the user changes the number of sync threads to use in the GUI.  A running sync picks up the new count
+        straight away
         """
         self.pool.setMaxThreadCount(self.syncThreads.value())
+        if self.main_sync_thread:
+            self.main_sync_thread.core.set_workers(self.syncThreads.value())
 
 
     def btn_select_source_folder(self, source=None):
@@ -124,7 +308,8 @@ class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
 
                 break
 
-        self.write_to_gui_console("No Supported Games Found In Selected Directory", bold=True, color="Red")
+        self.write_to_gui_console("No Supported Games Found In Selected Directory", bold=True, color="Red",
+                                  level=logging.WARNING)
         self.sourceDirDisplay.setText("")
         self.input_directory = ""
 
@@ -163,81 +348,40 @@ class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
         self.excludeListDisplay.setText(exclude_file)
 
         if not os.path.isfile(exclude_file):
-            self.write_to_gui_console("Provided Exlude List Is Not a Valid File: " + exclude_file)
+            self.write_to_gui_console("Provided Exlude List Is Not a Valid File: " + exclude_file,
+                                      level=logging.WARNING)
             return
 
-        self.exclude_list = []
-        with open(exclude_file, "r") as f:
-            for i in f:
-                self.exclude_list.append(i.strip("\n"))
+        self.exclude_list = load_exclude_list(exclude_file)
 
         self.write_to_gui_console(str(len(self.exclude_list)) + " Files Added To Exclude List")
 
 
-    def run_sync(self):
+    def plan_sync(self):
+        self.run_sync(plan_only=True)
+
+    def run_sync(self, plan_only=False):
         """
         This is called when the user click the Sync Now button in the GUI.
-
+        :param plan_only: Called from the Plan button.  Only work out what the sync would do
         """
 
         if not self.sourceDirDisplay.text():
-            self.write_to_gui_console("No Source Directory Selected, Sync Cannot Run", bold=True, color="red")
+            self.write_to_gui_console("No Source Directory Selected, Sync Cannot Run", bold=True, color="red",
+                                      level=logging.ERROR)
             return
 
         if not self.destDirDisplay.text():
-            self.write_to_gui_console("No FastDL Directory Selected, Sync Cannot Run", bold=True, color="red")
+            self.write_to_gui_console("No FastDL Directory Selected, Sync Cannot Run", bold=True, color="red",
+                                      level=logging.ERROR)
             return
 
         self.progressBar.reset()
-        self.cleanup_opposite_sync_type()
-        self.process_fastdl_manifest()
-        self.start_sync()
-
-
+        self.start_sync(plan_only=plan_only)
 
-    def write_fastdl_manifest(self):
-        """
-        Once the sync has completed.  It takes the list manifest list we build during the sync and writes it to file.
-
-        """
-        with open(os.path.join(self.input_directory, "fastdownload.txt"), "w+") as file:
-            for line in self.fastdl_manifest:
-                file.write(line + "\n")
-        self.fastdl_manifest = []
 
-    def update_fastdl_manifest(self, synced_files):
-        """
-        Update the the list of files we have synced so we can write manifest at the end of sync.
-        """
-        for file in synced_files:
-            if not file["input"] in self.fastdl_manifest:
-                self.fastdl_manifest.append(file["input"])
 
-    def process_fastdl_manifest(self):
-        """
-        Check the existing manifest to see if any files have been removed from server.  If they have, check the fastdl
-        folder and see if they exist.  If they do, delete them.
-        :return:
-        """
-        manifest_file = os.path.join(self.sourceDirDisplay.text(), "fastdownload.txt")
-        self.write_to_gui_console("Checking For Manifest File: " + manifest_file)
-        if os.path.isfile(manifest_file):
-            self.write_to_gui_console("Processing Existing FastDL Manifest")
-            with open(manifest_file, "r") as manifest:
-                for line in manifest:
-                    input_file = line.strip("\n").lower()
-                    output_dir, output_file, relative_game_path = self.generate_output_paths(input_file)
-
-                    if os.path.isfile(input_file):
-                        self.fastdl_manifest.append(input_file)
-                    else:
-                        self.write_to_gui_console("<strong>Located File That That Has Been Removed.  Deleting From FastDL. " + input_file + "</strong>")
-                        if os.path.isfile(output_file):
-                            os.remove(output_file)
-                        if os.path.isfile(output_file + ".bz2"):
-                            os.remove(output_file + ".bz2")
-
-    def start_sync(self):
+    def start_sync(self, plan_only=False):
         """
         This starts the main thread that handles the syncing processing.
 
@@ -246,14 +390,33 @@ class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
         """
 
         self.runSync.setDisabled(True)
+        self.planSync.setDisabled(True)
+        self.pauseSync.setDisabled(False)
+        self.cancelSync.setDisabled(False)
+        self.failed_file_sync = []
 
-        self.main_sync_thread = ProcessSourceDir(self.input_directory, self.output_dir, self.bZipEnable.isChecked(), self.pool, self.exclude_list)
-        self.connect(self.main_sync_thread, SIGNAL("sync_thread_started(PyQt_PyObject)"), self.sig_sync_thread_started)
-        self.connect(self.main_sync_thread, SIGNAL("sync_thread_finished(PyQt_PyObject)"), self.sig_sync_thread_finished)
-        self.connect(self.main_sync_thread, SIGNAL("newer_file_detected(PyQt_PyObject)"), self.sig_new_file_detected)
-        self.connect(self.main_sync_thread, SIGNAL("file_queued(PyQt_PyObject)"), self.sig_sync_file_queued)
-        self.connect(self.main_sync_thread, SIGNAL("update_fastdl_manifest(PyQt_PyObject)"), self.update_fastdl_manifest)
-        self.connect(self.main_sync_thread, SIGNAL("update_active_thread(PyQt_PyObject)"), self.update_active_threads)
+        if self.cacheArtifacts.isChecked() and not self.artifact_cache:
+            self.artifact_cache = ArtifactCache(self.artifact_cache_dir)
+
+        self.main_sync_thread = ProcessSourceDir(self.input_directory, self.output_dir, self.bZipEnable.isChecked(),
+                                                 self.pool, self.exclude_list, engine=self.selected_engine(),
+                                                 block_workers=self.selected_block_workers(),
+                                                 hash_mode=self.contentHash.isChecked(),
+                                                 policy=self.compression_policy, report_file=self.report_file,
+                                                 link_files=self.linkFiles.isChecked(),
+                                                 order=SYNC_ORDERS[self.orderCombo.currentIndex()][1],
+                                                 artifact_cache=self.artifact_cache if
+                                                 self.cacheArtifacts.isChecked() else None, plan_only=plan_only)
+        self.connect(self.main_sync_thread, SIGNAL("sync_events(PyQt_PyObject)"), self.sig_sync_events)
+        self.connect(self.main_sync_thread, SIGNAL("file_removed(PyQt_PyObject, PyQt_PyObject)"), self.sig_file_removed)
+        self.connect(self.main_sync_thread, SIGNAL("stale_output_found(PyQt_PyObject, PyQt_PyObject)"),
+                     self.sig_stale_output_found)
+        self.connect(self.main_sync_thread, SIGNAL("cleanup_completed(PyQt_PyObject)"), self.sig_cleanup_completed)
+        self.connect(self.main_sync_thread, SIGNAL("scan_completed(PyQt_PyObject)"), self.sig_scan_completed)
+        self.connect(self.main_sync_thread, SIGNAL("progress_updated(PyQt_PyObject, PyQt_PyObject)"), self.sig_progress_updated)
+        self.connect(self.main_sync_thread, SIGNAL("file_failed(PyQt_PyObject)"), self.sig_file_failed)
+        self.connect(self.main_sync_thread, SIGNAL("sync_report(PyQt_PyObject)"), self.sig_sync_report)
+        self.connect(self.main_sync_thread, SIGNAL("sync_plan(PyQt_PyObject)"), self.sig_sync_plan)
         self.connect(self.main_sync_thread, SIGNAL("sync_completed"), self.sig_sync_completed)
         self.connect(self.main_sync_thread, SIGNAL("set_progress_max(PyQt_PyObject)"), self.sig_set_progress_bar_max)
         self.main_sync_thread.start()
@@ -269,105 +432,163 @@ class FastDLSyncGui(QtGui.QMainWindow, design.Ui_MainWindow):
         else:
             self.progressBar.setMaximum(1)
 
-    def sig_new_file_detected(self, file):
-        self.write_to_gui_console("Newer File Detected: " + file)
+    def sig_sync_events(self, events):
+        """
+        Per file events the sync thread sends in batches instead of one signal each
+        """
+        handlers = {"file_queued": self.sig_sync_file_queued, "newer_file_detected": self.sig_new_file_detected,
+                    "sync_thread_started": self.sig_sync_thread_started, "file_synced": self.sig_file_synced}
+        for event, args in events:
+            handlers[event](*args)
+
+    def sig_new_file_detected(self, file, rule):
+        self.write_to_gui_console("Newer File Detected (" + rule + "): " + file, level=logging.DEBUG)
+
+    def sig_file_removed(self, file, dry_run):
+        if dry_run:
+            self.write_to_gui_console("Located File That Has Been Removed.  Would Delete From FastDL. " + file)
+            return
+        self.write_to_gui_console("Located File That That Has Been Removed.  Deleting From FastDL. " + file, bold=True)
+
+    def sig_stale_output_found(self, file, dry_run):
+        self.write_to_gui_console(("Would Delete: " if dry_run else "Deleting: ") + file, level=logging.DEBUG)
+
+    def sig_cleanup_completed(self, stats):
+        if stats["dry_run"]:
+            self.write_to_gui_console("Found " + str(stats["stale_outputs"]) + " Files To Clean Up")
+            return
+        if self.bZipEnable.isChecked():
+            message = "Bzip Selected.  Cleaned Up " + str(stats["stale_outputs"]) + " Existing Raw Files"
+        else:
+            message = "Bzip Not Selected.  Cleaned Up " + str(stats["stale_outputs"]) + " Existing Bzip Files"
+        self.write_to_gui_console(message)
+        for path, error in stats["delete_errors"]:
+            self.write_to_gui_console("Could Not Delete " + path + ": " + error, color="red", level=logging.WARNING)
+
+    def sig_scan_completed(self, stats):
+        self.write_to_gui_console("Scanned " + str(stats["files_scanned"]) + " Files In " + str(stats["dirs_scanned"]) +
+                                  " Directories.  Skipped " + str(stats["dirs_pruned"]) + " Excluded Directories And " +
+                                  str(stats["files_excluded"]) + " Excluded Files")
+        if stats["dirs_failed"]:
+            self.write_to_gui_console("Could Not Read " + str(stats["dirs_failed"]) + " Directories.  Removed Files "
+                                      "Won't Be Deleted From FastDL Until A Full Scan Succeeds", color="red",
+                                      level=logging.WARNING)
+        if stats["files_interrupted"]:
+            self.write_to_gui_console("Resumed Interrupted Sync.  " + str(stats["files_recovered"]) + " Of " +
+                                      str(stats["files_interrupted"]) + " Unfinished Files Had Already Been Written",
+                                      bold=True)
 
     def sig_sync_file_queued(self, file):
-        self.write_to_gui_console("File Queued For Sync: " + file)
+        self.write_to_gui_console("File Queued For Sync: " + file, level=logging.DEBUG)
+
+    def sig_file_failed(self, failure):
+        self.failed_file_sync.append(failure)
+        self.write_to_gui_console("Failed To Sync " + failure["file"] + " After " + str(failure["attempts"]) +
+                                  " Attempt(s): " + failure["error"] + ": " + failure["message"], color="red",
+                                  level=logging.WARNING)
+
+    def sig_sync_report(self, summary):
+        self.write_to_gui_console("Synced " + str(summary["files_synced"]) + " Files In " +
+                                  str(summary["wall_time"]) + " Seconds (" + str(summary["mb_per_second"]) +
+                                  " MB/s).  Compression Ratio: " + str(summary["ratio"]))
+        if summary["cache_hits"]:
+            self.write_to_gui_console(str(summary["cache_hits"]) + " Files Placed From The Artifact Cache")
+        for record in summary["slowest_files"][:3]:
+            self.write_to_gui_console("Slow File: " + record["file"] + " (" + str(record["total_time"]) + "s)")
+        if summary["files_failed"]:
+            self.write_to_gui_console(str(summary["files_failed"]) + " Files Failed To Sync And Will Be Retried On "
+                                      "The Next Sync", bold=True, color="red", level=logging.ERROR)
+            for failure in summary["failures"][:5]:
+                self.write_to_gui_console("Failed: " + failure["file"] + " (" + failure["error"] + ")", color="red",
+                                          level=logging.ERROR)
+        self.write_to_gui_console("Sync Report Written To " + self.report_file)
+
+    def sig_sync_plan(self, plan):
+        totals = plan["totals"]
+        self.write_to_gui_console("Sync Plan: " + str(totals["files_to_add"]) + " New Files, " +
+                                  str(totals["files_to_update"]) + " Updated Files, " +
+                                  str(round(totals["bytes_to_sync"] / 1048576.0, 1)) + " MB To Sync (" +
+                                  str(round(totals["bytes_to_compress"] / 1048576.0, 1)) + " MB To Compress)", bold=True)
+        self.write_to_gui_console(str(totals["stale_outputs"]) + " Stale Files And " + str(totals["removed_files"]) +
+                                  " Files Removed From The Server Would Be Deleted From FastDL", bold=True)
+        if plan["estimated_seconds"] is None:
+            self.write_to_gui_console("No Previous Syncs To Estimate The Time From")
+        else:
+            self.write_to_gui_console("Estimated Time: " + str(plan["estimated_seconds"]) + " Seconds At " +
+                                      str(plan["mb_per_second"]) + " MB/s With " + str(plan["measured_workers"]) +
+                                      " Threads", bold=True, color="green")
+        self.progressBar.reset()
+        self.reset_sync_controls()
 
     def sig_sync_completed(self):
-        self.write_fastdl_manifest()
         self.progressBar.setValue(self.progressBar.maximum())
         self.activeThreads.setText("0")
         self.write_to_gui_console("Sync Has Completed", bold=True, color="green")
         self.write_to_gui_console("Total Files Synced: " + str(self.total_files_to_sync), bold=True, color="green")
+        self.reset_sync_controls()
+
+    def reset_sync_controls(self):
+        """
+        Reset the controls once a sync or plan is done
+        """
         self.runSync.setDisabled(False)
+        self.planSync.setDisabled(False)
+        self.pauseSync.setDisabled(True)
+        self.pauseSync.setChecked(False)
+        self.cancelSync.setDisabled(True)
 
-    def update_active_threads(self, count):
-        self.activeThreads.setText(str(count))
+    def sig_progress_updated(self, finished, active):
+        """
+        Batched progress from the sync thread.  Arrives a few times a second no matter how many files are finishing
+        """
+        if finished > self.progressBar.maximum():
+            # The scan is still raising the max, don't let the bar drop an update that got ahead of it
+            self.progressBar.setMaximum(finished)
+        self.progressBar.setValue(finished)
+        self.activeThreads.setText(str(active))
 
     def sig_sync_thread_started(self, message):
-        self.write_to_gui_console(message)
+        self.write_to_gui_console(message, level=logging.DEBUG)
 
-    def sig_sync_thread_finished(self, temp):
-        self.thread_lock.lock()
-        self.progressBar.setValue(self.progressBar.value() + 1)
-        self.thread_lock.unlock()
+    def sig_file_synced(self, record):
+        self.write_to_gui_console("Synced " + record["file"] + ": " + str(record["bytes_in"]) + " Bytes In, " +
+                                  str(record["bytes_out"]) + " Bytes Out", level=logging.DEBUG)
 
-    def cleanup_opposite_sync_type(self):
+    def write_to_gui_console(self, line, bold=None, color=None, level=logging.INFO):
         """
-        Cleanup Previously sync files that do not match the current sync type (Bzip on/off)
-
-        If the user selects to Bzip the files all files with .bz2 ext are deleted.
-
-        This is a potentially destructive method.  If fed a random directory without Bzip enabled it will delete everything
+        Convenience method for writing to the GUI's output text box.  The line is buffered and shows up on the next
+        flush_gui_console()
+        :param level: logging level of the line.  Lines below the selected Log Level aren't shown
         """
+        self.log.write(line, level=level, bold=bold, color=color)
 
-        if self.bZipEnable.isChecked():
-            self.write_to_gui_console("Bzip Selected.  Cleanup Up Existing Raw Files")
-        else:
-            self.write_to_gui_console("Bzip Not Selected.  Cleanup Up Existing Bzip Files")
-
-        if not os.path.isdir(self.output_dir):
-            return
-
-        for curdir, dirs, files in os.walk(self.output_dir):
-
-            for f in files:
-                name, ext = os.path.splitext(f)
-                if ext:
-                    # TODO catch exception here
-                    if self.bZipEnable.isChecked():
-                        if not ext == ".bz2":
-                            self.write_to_gui_console("Deleting: " + os.path.join(curdir, f))
-                            os.remove(os.path.join(curdir, f))
-                    else:
-                        if ext == ".bz2":
-                            self.write_to_gui_console("Deleting: " + os.path.join(curdir, f))
-                            os.remove(os.path.join(curdir, f))
-
-    def generate_output_paths(self, input_file):
-        """
-        Generate the relative and full output paths.  Return the output directory, the absolute output path and
-        relative game directory
-        :param input_file:
-        :return:
+    def flush_gui_console(self):
         """
+        Draw the lines logged since the last flush.  Runs on log_timer
+        """
+        lines = self.log.take_pending()
+        if lines:
+            self.append_gui_console(lines)
 
-        relative_game_path = input_file.replace(self.input_directory + "\\", "") # Strip everything except game directories
-
-        temp = os.path.join(self.output_dir, relative_game_path)
-        output_dir = os.path.dirname(temp)
-        output_file = os.path.join(output_dir, os.path.basename(input_file))
-
-        if self.bZipEnable.isChecked():
-            output_file += ".bz2"
-
-        return output_dir, output_file, relative_game_path
-
-    def write_to_gui_console(self, line, bold=None, color=None):
+    def append_gui_console(self, lines):
         """
-        Convenience method for writing to the GUI's output text box
+        Add a batch of HTML lines to the text box as a single edit and scroll to the end once
         """
-        output_string = ""
-        if bold:
-            output_string += "<strong>"
-        if color:
-            output_string += '<span style="color:' + color + ';">'
-
-        output_string += line
-
-        if bold:
-            output_string += "</strong>"
-        if color:
-            output_string += "</span>"
+        cursor = QtGui.QTextCursor(self.mainTextWindow.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.beginEditBlock()
+        for line in lines:
+            if not self.mainTextWindow.document().isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(line)
+        cursor.endEditBlock()
 
-        self.mainTextWindow.append(output_string)
-        self.mainTextWindow.ensureCursorVisible()
+        self.text_virtical_scroll.setValue(self.text_virtical_scroll.maximum())
 
 
 
 def main():
+    multiprocessing.freeze_support()  # Needed for the process engine in py2exe builds
     app = QtGui.QApplication(sys.argv)
     form = FastDLSyncGui()
     form.show()
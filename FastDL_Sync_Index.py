@@ -0,0 +1,252 @@
+import hashlib
+import os
+import sqlite3
+
+# Name of the index file kept in the root of the source directory.  Replaces the old fastdownload.txt manifest.  A
+# source synced to more than one FastDL directory gets an index per destination, named INDEX_FILE_NAME.<hash>
+INDEX_FILE_NAME = "fastdownload.db"
+LEGACY_MANIFEST_NAME = "fastdownload.txt"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Number of recent syncs averaged to estimate how long a sync plan will take
+THROUGHPUT_HISTORY = 5
+
+
+def file_digest(path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    BLAKE2b digest of a file's contents, read in fixed size chunks
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SyncIndex(object):
+    """
+    Persistent record of every file we have synced to FastDL.
+
+    For each source file we store its size and mtime at the time it was synced along with the output file it was
+    written to and, in content hash mode, the digest of its contents.  A file whose size, mtime and output path still
+    match the index doesn't need to be synced again, so an incremental sync only has to stat the source tree and never
+    has to touch the FastDL directory.
+
+    The stored digest doubles as a digest cache keyed by (path, size, mtime).  A file is only hashed again once its
+    stat data changes.
+
+    All lookups go through an in memory dict loaded when the index is opened.  Changes are written back in a single
+    transaction by commit()
+
+    The journal table holds files that were queued but haven't been marked synced yet.  Anything left in it when a
+    sync opens the index was interrupted by a crash or cancel.
+
+    The history table keeps the bytes and time of recent syncs, used to estimate how long a planned sync will take.
+
+    Each index belongs to one FastDL directory, recorded in the settings table.  The first destination a source is
+    synced to keeps INDEX_FILE_NAME, any other gets its own index next to it so the destinations don't resync or
+    remove each other's files
+    """
+
+    def __init__(self, source_dir, output_dir=None):
+        self.index_file = os.path.join(source_dir, INDEX_FILE_NAME)
+        self.entries = {}  # path -> (size, mtime, output, digest, fallback)
+        self.pending = {}
+        self.removed = set()
+        self.journal_pending = {}  # path -> (size, mtime, output, digest, queued time)
+        self.journal_done = set()
+
+        self.conn = self.connect()
+        if output_dir is not None:
+            destination = os.path.normcase(os.path.abspath(output_dir))
+            if self.claim(destination) != destination:
+                self.conn.close()
+                self.index_file += "." + hashlib.blake2b(destination.encode("utf-8"), digest_size=6).hexdigest()
+                self.conn = self.connect()
+                self.claim(destination)
+
+        for row in self.conn.execute("SELECT path, size, mtime, output, digest, fallback FROM synced_files"):
+            self.entries[row[0]] = (row[1], row[2], row[3], row[4], bool(row[5]))
+
+        # The old manifest belongs to the destination that was synced before there were indexes
+        if not self.entries and os.path.basename(self.index_file) == INDEX_FILE_NAME:
+            self.import_legacy_manifest(os.path.join(source_dir, LEGACY_MANIFEST_NAME))
+
+    def connect(self):
+        conn = sqlite3.connect(self.index_file, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS synced_files "
+                     "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, output TEXT, digest TEXT, fallback INTEGER)")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(synced_files)")]
+        if "digest" not in columns:
+            conn.execute("ALTER TABLE synced_files ADD COLUMN digest TEXT")
+        if "fallback" not in columns:
+            conn.execute("ALTER TABLE synced_files ADD COLUMN fallback INTEGER")
+        conn.execute("CREATE TABLE IF NOT EXISTS journal "
+                     "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, output TEXT, digest TEXT, queued REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS history "
+                     "(finished REAL, files INTEGER, bytes_in INTEGER, wall_time REAL, workers INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+        return conn
+
+    def claim(self, destination):
+        """
+        Record the destination as this index's own if it doesn't have one yet.  Indexes from before destinations were
+        recorded are claimed by the first destination synced after the upgrade
+        :return: The destination the index belongs to
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('destination', ?)", (destination,))
+        return self.conn.execute("SELECT value FROM settings WHERE key = 'destination'").fetchone()[0]
+
+    def import_legacy_manifest(self, manifest_file):
+        """
+        Pull in the paths from an old fastdownload.txt manifest.  We don't know their size, mtime or output so they
+        are stored without them and get checked against the FastDL directory the first time they are seen
+        """
+        if not os.path.isfile(manifest_file):
+            return
+
+        with open(manifest_file, "r") as manifest:
+            for line in manifest:
+                path = line.strip("\n").lower()
+                if path:
+                    # Old syncs could mix separators or leave .. in the path, match the paths the walk produces
+                    path = os.path.normpath(path)
+                    self.pending[path] = (None, None, None, None, False)
+
+        self.commit()
+
+    def get(self, path):
+        """
+        Return the (size, mtime, output, digest, fallback) recorded for the path, or None if it has never been synced
+        """
+        return self.entries.get(path)
+
+    def is_current(self, path, size, mtime, output):
+        """
+        Check if the recorded state of a file matches its current size, mtime and output path
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        return entry[0] == size and entry[1] == mtime and self.output_matches(entry, output)
+
+    @staticmethod
+    def output_matches(entry, output):
+        """
+        Check if an entry was written to the given output.  A file that was meant to be compressed but was stored raw
+        because compression didn't pay off (a fallback) matches its .bz2 output too
+        """
+        if entry[2] == output:
+            return True
+        return bool(entry[4]) and output.endswith(".bz2") and entry[2] == output[:-len(".bz2")]
+
+    def fallback_outputs(self):
+        """
+        Raw outputs that were written in place of a .bz2.  These belong in a Bzip sync and shouldn't be cleaned up
+        """
+        return set(entry[2] for entry in self.entries.values() if entry[4])
+
+    def get_digest(self, path, size, mtime, source_path=None):
+        """
+        Return the digest of a file's contents.  The cached digest is reused as long as the size and mtime match what
+        was recorded, otherwise the file is hashed again
+        :param path: Path the file is indexed under
+        :param source_path: Path to read the file from if it differs from the indexed path
+        """
+        entry = self.pending.get(path) or self.entries.get(path)
+        if entry is not None and entry[3] and entry[0] == size and entry[1] == mtime:
+            return entry[3]
+        return file_digest(source_path or path)
+
+    def mark_synced(self, path, size, mtime, output, digest=None, fallback=False):
+        self.pending[path] = (size, mtime, output, digest, fallback)
+        self.journal_finish(path)
+
+    def remove(self, path):
+        self.pending.pop(path, None)
+        self.removed.add(path)
+        self.journal_finish(path)
+
+    def journal_start(self, path, size, mtime, output, digest, queued):
+        """
+        Record a file that's about to be synced.  It stays in the journal until it's marked synced
+        """
+        self.journal_done.discard(path)
+        self.journal_pending[path] = (size, mtime, output, digest, queued)
+
+    def journal_finish(self, path):
+        self.journal_pending.pop(path, None)
+        self.journal_done.add(path)
+
+    def journal_entries(self):
+        """
+        Return the (path, size, mtime, output, digest, queued) of every file still in the journal on disk
+        """
+        return self.conn.execute("SELECT path, size, mtime, output, digest, queued FROM journal").fetchall()
+
+    def paths(self):
+        return self.entries.keys()
+
+    def record_sync(self, finished, files, bytes_in, wall_time, workers):
+        """
+        Add a finished sync to the throughput history.  Written straight away, it isn't part of commit()
+        """
+        with self.conn:
+            self.conn.execute("INSERT INTO history (finished, files, bytes_in, wall_time, workers) "
+                              "VALUES (?, ?, ?, ?, ?)", (finished, files, bytes_in, wall_time, workers))
+
+    def recent_throughput(self, limit=THROUGHPUT_HISTORY):
+        """
+        Bytes per second over the last few syncs that did any work
+        :return: (bytes per second, workers used by the last of them), or (None, None) if there's no history yet
+        """
+        rows = self.conn.execute("SELECT bytes_in, wall_time, workers FROM history WHERE bytes_in > 0 AND wall_time > 0 "
+                                 "ORDER BY finished DESC LIMIT ?", (limit,)).fetchall()
+        if not rows:
+            return None, None
+        return sum(row[0] for row in rows) / float(sum(row[1] for row in rows)), rows[0][2]
+
+    def commit(self):
+        """
+        Write all pending changes to disk in a single transaction
+        """
+        with self.conn:
+            if self.removed:
+                self.conn.executemany("DELETE FROM synced_files WHERE path = ?", ((p,) for p in self.removed))
+            if self.pending:
+                self.conn.executemany("INSERT OR REPLACE INTO synced_files "
+                                      "(path, size, mtime, output, digest, fallback) VALUES (?, ?, ?, ?, ?, ?)",
+                                      ((p,) + entry for p, entry in self.pending.items()))
+            if self.journal_done:
+                self.conn.executemany("DELETE FROM journal WHERE path = ?", ((p,) for p in self.journal_done))
+            if self.journal_pending:
+                self.conn.executemany("INSERT OR REPLACE INTO journal (path, size, mtime, output, digest, queued) "
+                                      "VALUES (?, ?, ?, ?, ?, ?)",
+                                      ((p,) + entry for p, entry in self.journal_pending.items()))
+
+        for path in self.removed:
+            self.entries.pop(path, None)
+        self.entries.update(self.pending)
+        self.pending = {}
+        self.removed = set()
+        self.journal_pending = {}
+        self.journal_done = set()
+
+    def close(self):
+        self.conn.close()
+
+
+def load_fallback_outputs(source_dir, output_dir=None):
+    """
+    Read the raw outputs a Bzip sync wrote in place of a .bz2 from the source directory's index for output_dir
+    """
+    sync_index = SyncIndex(source_dir, output_dir)
+    outputs = sync_index.fallback_outputs()
+    sync_index.close()
+    return outputs
@@ -0,0 +1,135 @@
+import csv
+import json
+import os
+import time
+
+# Number of files listed in the slowest_files section of the summary
+SLOWEST_FILES = 10
+
+# Columns of the per file records, in the order they're written to a CSV report
+RECORD_FIELDS = ["file", "ext", "bytes_in", "bytes_out", "ratio", "fallback", "scan_time", "queue_wait", "read_time",
+                 "compress_time", "write_time", "total_time", "attempts", "cache", "error", "message"]
+
+STAGES = ["scan_time", "queue_wait", "read_time", "compress_time", "write_time"]
+
+
+def ratio(bytes_out, bytes_in):
+    if not bytes_in:
+        return None
+    return round(bytes_out / float(bytes_in), 4)
+
+
+class SyncReport(object):
+    """
+    Collects timings for every file in a sync and summarises them once it's done.
+
+    Per file records hold the time spent checking the file during the scan, waiting in the queue for a worker, and
+    reading, compressing and writing it, along with the bytes read and written.  Files that failed to sync are kept
+    separately in failures
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.scan_time = 0.0
+        self.records = []
+        self.failures = []
+
+    def add_file(self, file, result):
+        """
+        Record a finished sync job
+        :param file: The file dict built by SyncCore.check_file()
+        :param result: The result dict returned by bzip_job() or copy_job()
+        :return: The per file record
+        """
+        record = {
+            "file": file["input"],
+            "ext": os.path.splitext(file["input"])[1],
+            "bytes_in": result["bytes_in"],
+            "bytes_out": result["bytes_out"],
+            "ratio": ratio(result["bytes_out"], result["bytes_in"]),
+            "fallback": result["output"] != file["output"],
+            "scan_time": round(file.get("scan_time", 0.0), 6),
+            "queue_wait": round(max(0.0, result["started"] - file.get("queued", result["started"])), 6),
+            "read_time": round(result["read_time"], 6),
+            "compress_time": round(result["compress_time"], 6),
+            "write_time": round(result["write_time"], 6),
+            "total_time": round(result["finished"] - result["started"], 6),
+            "attempts": result.get("attempts", 1),
+            "cache": result.get("cache"),
+        }
+        self.records.append(record)
+        return record
+
+    def add_failure(self, failure):
+        """
+        Record a file that failed to sync
+        :param failure: The failure dict built by SyncCore.collect_failure()
+        """
+        self.failures.append(failure)
+
+    def summary(self, scan_stats=None, slowest=SLOWEST_FILES):
+        """
+        Totals for the whole sync: throughput, time spent in each stage, the slowest files and the compression ratio
+        for each extension
+        :param scan_stats: SyncCore.scan_stats, included as is
+        """
+        finished = time.time()
+        wall_time = finished - self.started
+        bytes_in = sum(record["bytes_in"] for record in self.records)
+        bytes_out = sum(record["bytes_out"] for record in self.records)
+
+        extensions = {}
+        for record in self.records:
+            ext = extensions.setdefault(record["ext"] or "(none)", {"files": 0, "bytes_in": 0, "bytes_out": 0})
+            ext["files"] += 1
+            ext["bytes_in"] += record["bytes_in"]
+            ext["bytes_out"] += record["bytes_out"]
+        for ext in extensions.values():
+            ext["ratio"] = ratio(ext["bytes_out"], ext["bytes_in"])
+
+        return {
+            "started": self.started,
+            "finished": finished,
+            "wall_time": round(wall_time, 3),
+            "scan_time": round(self.scan_time, 3),
+            "scan_stats": dict(scan_stats or {}),
+            "files_synced": len(self.records),
+            "files_failed": len(self.failures),
+            "cache_hits": sum(1 for record in self.records if record["cache"] == "hit"),
+            "retries": sum(record["attempts"] - 1 for record in self.records + self.failures),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "ratio": ratio(bytes_out, bytes_in),
+            "files_per_second": round(len(self.records) / wall_time, 2) if wall_time else None,
+            "mb_per_second": round(bytes_in / 1048576.0 / wall_time, 2) if wall_time else None,
+            "stage_totals": dict((stage, round(sum(record[stage] for record in self.records), 3))
+                                 for stage in STAGES),
+            "slowest_files": sorted(self.records, key=lambda record: record["total_time"], reverse=True)[:slowest],
+            "extensions": extensions,
+            "failures": list(self.failures),
+        }
+
+
+def write_report(report_file, summary, records):
+    """
+    Write a sync report.  A .csv file gets one row per synced file, slowest first, followed by a row for each failed
+    file.  Anything else is written as JSON with the summary and every file record
+    """
+    report_dir = os.path.dirname(report_file)
+    if report_dir and not os.path.isdir(report_dir):
+        os.makedirs(report_dir, exist_ok=True)
+
+    if report_file.lower().endswith(".csv"):
+        with open(report_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for record in sorted(records, key=lambda record: record["total_time"], reverse=True):
+                writer.writerow(record)
+            for failure in summary.get("failures", []):
+                writer.writerow(failure)
+        return
+
+    report = dict(summary)
+    report["files"] = records
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
@@ -1,15 +1,26 @@
-from PyQt4.QtCore import QThread, SIGNAL, QRunnable, QObject, pyqtSignal
-import bz2
+from PyQt4.QtCore import QThread, SIGNAL, QRunnable
+from concurrent.futures import wait
+from collections import deque
 import os
-import shutil
+import threading
+import time
+
+from FastDL_Sync_Core import SyncCore, SyncListener, ENGINE_THREAD, ENGINE_PROCESS, INDEX_COMMIT_INTERVAL, \
+    ORDER_LARGEST, PENDING_JOBS, PROGRESS_INTERVAL
+from FastDL_Compression import compress_file, bzip_job, copy_job, run_job, make_output_dir, DEFAULT_CHUNK_SIZE, \
+    DEFAULT_COMPRESS_LEVEL, DEFAULT_RETRIES, COMPRESS
 
 class BzipThread(QThread):
 
-    def __init__(self, input_file, output_file, output_dir):
+    def __init__(self, input_file, output_file, output_dir, compresslevel=DEFAULT_COMPRESS_LEVEL,
+                 chunk_size=DEFAULT_CHUNK_SIZE, block_workers=0):
         QThread.__init__(self)
         self.input_file = input_file
         self.output_file = output_file
         self.output_dir = output_dir
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.block_workers = block_workers
 
     def __del__(self):
         self.wait()
@@ -18,60 +29,95 @@ class BzipThread(QThread):
 
         self.emit(SIGNAL('thread_started(PyQt_PyObject)'), "Compressing " + os.path.basename(self.input_file))
 
-        if not os.path.isdir(self.output_dir):
-            os.makedirs(self.output_dir)
-
-        with open(self.input_file, "rb") as source:
-            # TODO Need to check into what exceptions this can throw
-            with bz2.open(self.output_file, "wb", compresslevel=5) as destination:
-                destination.write(source.read())
+        make_output_dir(self.output_dir)
 
-class ThreadSignals(QObject):
-    thread_started = pyqtSignal(str)
-    thread_finished = pyqtSignal(str)
+        # TODO Need to check into what exceptions this can throw
+        compress_file(self.input_file, self.output_file, compresslevel=self.compresslevel, chunk_size=self.chunk_size,
+                      block_workers=self.block_workers)
 
 class BzipRunner(QRunnable):
 
-    def __init__(self, input_file, output_file, output_dir):
+    def __init__(self, input_file, output_file, output_dir, compresslevel=DEFAULT_COMPRESS_LEVEL,
+                 chunk_size=DEFAULT_CHUNK_SIZE, block_workers=0, max_ratio=None, on_finished=None, wait_to_run=None,
+                 retries=DEFAULT_RETRIES, cache_dir=None, digest=None, on_started=None):
         super(BzipRunner, self).__init__()
         self.input_file = input_file
         self.output_file = output_file
         self.output_dir = output_dir
-        self.signals = ThreadSignals()
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.block_workers = block_workers
+        self.max_ratio = max_ratio
+        self.on_started = on_started  # Called from the pool thread with a message, like on_finished
+        self.on_finished = on_finished  # Called from the pool thread, without going through the Qt event loop
+        self.wait_to_run = wait_to_run  # Blocks while the sync is paused, returns False if it was cancelled
+        self.retries = retries
+        self.cache_dir = cache_dir  # Artifact cache, see ArtifactCache
+        self.digest = digest
+        self.result = None
+        self.error = None  # The SyncJobError if the job failed
+        self.skipped = False
+        self.done = False
 
     def run(self):
 
-        self.signals.thread_started.emit("Compressing: " + os.path.basename(self.input_file))
-
-        if not os.path.isdir(self.output_dir):
-            os.makedirs(self.output_dir)
-
-        with open(self.input_file, "rb") as source:
-            # TODO Need to check into what exceptions this can throw
-            with bz2.open(self.output_file, "wb", compresslevel=5) as destination:
-                destination.write(source.read())
-
-        self.signals.thread_finished.emit("done")
+        try:
+            if self.wait_to_run and not self.wait_to_run():
+                self.skipped = True
+                return
+
+            if self.on_started:
+                self.on_started("Compressing: " + os.path.basename(self.input_file))
+
+            # The result holds the job's timings, and the raw output file if compression didn't pay off
+            self.result = run_job(bzip_job, self.input_file, self.output_file, self.output_dir,
+                                  compresslevel=self.compresslevel, chunk_size=self.chunk_size,
+                                  block_workers=self.block_workers, max_ratio=self.max_ratio,
+                                  cache_dir=self.cache_dir, digest=self.digest, retries=self.retries)
+            self.output_file = self.result["output"]
+        except Exception as e:
+            # Exceptions can't leave a QRunnable, keep it for ProcessSourceDir to report
+            self.error = e
+        finally:
+            self.done = True
+            if self.on_finished:
+                self.on_finished()
 
 class NonBzipRunner(QRunnable):
 
-    def __init__(self, input_file, output_file, output_dir):
+    def __init__(self, input_file, output_file, output_dir, on_finished=None, link=False, wait_to_run=None,
+                 retries=DEFAULT_RETRIES, on_started=None):
         super(NonBzipRunner, self).__init__()
         self.input_file = input_file
         self.output_file = output_file
         self.output_dir = output_dir
-        self.signals = ThreadSignals()
+        self.link = link
+        self.on_started = on_started
+        self.on_finished = on_finished
+        self.wait_to_run = wait_to_run
+        self.retries = retries
+        self.result = None
+        self.error = None
+        self.skipped = False
+        self.done = False
 
     def run(self):
 
-        self.signals.thread_started.emit("Moving: " + os.path.basename(self.input_file))
+        if self.wait_to_run and not self.wait_to_run():
+            self.skipped = True
+        else:
+            if self.on_started:
+                self.on_started("Moving: " + os.path.basename(self.input_file))
 
-        try:
-            shutil.copy2(self.input_file, self.output_file)
-        except IOError as e:
-            pass
+            try:
+                self.result = run_job(copy_job, self.input_file, self.output_file, self.output_dir, link=self.link,
+                                      retries=self.retries)
+            except Exception as e:
+                self.error = e
 
-        self.signals.thread_finished.emit("done")
+        self.done = True
+        if self.on_finished:
+            self.on_finished()
 
 class StartSyncThreads(QThread):
 
@@ -98,122 +144,208 @@ class UpdateActiveThreads(QThread):
 
     def run(self):
 
-        while self.pool.activeThreadCount() > 0:
-            self.emit(SIGNAL('update_active_thread(PyQt_PyObject)'), self.pool.activeThreadCount())
-            self.sleep(0.2)
+        # Blocks until the pool is empty instead of polling it
+        self.pool.waitForDone()
 
         self.emit(SIGNAL('sync_completed'))
 
 
-class ProcessSourceDir(QThread):
+class ProcessSourceDir(QThread, SyncListener):
+    """
+    Runs a SyncCore on a background thread and forwards its progress to the GUI as Qt signals.  Finished files aren't
+    signalled one at a time, the GUI gets a progress_updated signal with the counts at a fixed rate instead.  The other
+    per file events are sent in batches, see queue_event()
+    """
 
-    def __init__(self, input_dir, output_dir, bzip, pool, exclude_list):
+    def __init__(self, input_dir, output_dir, bzip, pool, exclude_list, engine=ENGINE_THREAD, block_workers=0,
+                 hash_mode=False, policy=None, report_file=None, link_files=False, order=ORDER_LARGEST,
+                 retries=DEFAULT_RETRIES, artifact_cache=None, plan_only=False):
         QThread.__init__(self)
-        self.input_directory = input_dir
-        self.output_dir = output_dir
+        self.core = SyncCore(input_dir, output_dir, bzip, exclude_list, listener=self, block_workers=block_workers,
+                             hash_mode=hash_mode, policy=policy, report_file=report_file, link_files=link_files,
+                             order=order, retries=retries, artifact_cache=artifact_cache)
         self.bzip_enabled = bzip
-        self.exclude_list = exclude_list
-        self.files_to_sync = []
         self.pool = pool
+        self.engine = engine
+        self.block_workers = block_workers
+        self.plan_only = plan_only  # Only work out what the sync would do, see SyncCore.plan()
+        self.runners = deque()
+        self.events = []  # Per file events waiting for the next batch
+        self.events_lock = threading.Lock()
+        self.last_flush = 0
 
     def __del__(self):
         self.wait()
 
     def run(self):
 
-        for curdir, dirs, files in os.walk(self.input_directory):
-
-            for f in files:
-                input_file = os.path.join(curdir, f).lower()
-
-                output_dir, output_file, relative_game_path = self.generate_output_paths(input_file)
-
-                if self.check_exclude_list(relative_game_path):
-                    continue
-
-                if not os.path.isdir(output_dir):
-                    os.makedirs(output_dir)
-
-                if os.path.isfile(output_file):
-                    if not os.path.getmtime(input_file) > os.path.getmtime(output_file):
-                        continue
-                    else:
-                        os.remove(output_file)
-                        self.emit(SIGNAL('newer_file_detected(PyQt_PyObject)'), os.path.split(input_file))
+        if self.plan_only:
+            self.sync_plan(self.core.plan())
+            return
+
+        # Stale outputs are deleted here rather than on the GUI thread, a large FastDL directory can take a while
+        self.core.cleanup()
+
+        if self.bzip_enabled and self.engine == ENGINE_PROCESS:
+            self.core.run_pipeline(ENGINE_PROCESS, self.pool.maxThreadCount())
+            return
+
+        # Runners are started as the scan finds files so compression overlaps with the rest of the walk.  Files wait in
+        # the core's JobQueue and are handed to the pool highest priority first, no more than workers at a time.  Like
+        # SyncCore.run_pipeline() the scan waits once PENDING_JOBS files are queued, so memory stays flat.  Finished
+        # runners are collected as we go so the index is kept up to date in case the sync is interrupted
+        self.core.set_workers(self.pool.maxThreadCount())
+
+        def submit(file):
+            self.core.queue.push(file)
+            self.dispatch_runners()
+            while len(self.core.queue) >= PENDING_JOBS and not self.core.cancelled:
+                self.wait_for_runners()
+
+        self.core.scan(on_file=submit)
+        while self.runners or (self.core.queue and not self.core.cancelled):
+            self.wait_for_runners()
+        if self.core.cancelled:
+            self.core.drop_queued_jobs()
+        self.core.finish_sync()
+
+    def dispatch_runners(self):
+        """
+        Start runners for the highest priority queued files until every worker is busy, see SyncCore.dispatch_jobs()
+        """
+        core = self.core
+        while core.queue and len(self.runners) < core.workers and core.resumed.is_set() and not core.cancelled:
+            self.start_runner(core.queue.pop())
 
-                self.files_to_sync.append({"input": input_file, "output": output_file, "output_dir": output_dir})
+    def wait_for_runners(self):
+        """
+        Block until a runner finishes or the controls change, then collect finished runners and start more.  Wakes up
+        every INDEX_COMMIT_INTERVAL seconds regardless
+        """
+        wakeup = self.core.next_wakeup()
+        if not any(sync_thread.done for file, sync_thread in self.runners):
+            wait([wakeup], timeout=INDEX_COMMIT_INTERVAL)
 
-                self.emit(SIGNAL('file_queued(PyQt_PyObject)'), input_file)
+        self.collect_finished_runners()
+        if self.core.cancelled:
+            self.core.drop_queued_jobs()
+        self.dispatch_runners()
 
-        if len(self.files_to_sync) > 0:
-            self.emit(SIGNAL('update_fastdl_manifest(PyQt_PyObject)'), self.files_to_sync)
-            self.build_thread_pool()
-        self.emit(SIGNAL('set_progress_max(PyQt_PyObject)'), len(self.files_to_sync))
-        self.update_active_threads()
+    def runner_finished(self):
+        """
+        Called from the pool thread when a runner is done
+        """
+        self.core.progress.job_finished()
+        self.core.wake()
 
-    def build_thread_pool(self):
+    def collect_finished_runners(self):
+        """
+        Record every runner that's done in the sync index and let go of it.  Runners finish in any order, the rest are
+        kept whatever their place
+        """
+        running = deque()
+        for file, sync_thread in self.runners:
+            if not sync_thread.done:
+                running.append((file, sync_thread))
+            elif sync_thread.result:
+                self.core.collect_result(file, sync_thread.result)
+            elif sync_thread.error:
+                self.core.collect_failure(file, sync_thread.error)
+            elif sync_thread.skipped:
+                self.core.sync_index.journal_finish(file["input"])
+        self.runners = running
+
+    def start_runner(self, file):
+        """
+        Hand a single file to the QThreadPool.  We hold on to the runner so its result, with where it actually wrote
+        the file and how long it took, can be recorded once it's done.
 
-        for file in self.files_to_sync:
-            if self.bzip_enabled:
-                sync_thread = BzipRunner(file["input"], file["output"], file["output_dir"])
-            else:
-                sync_thread = NonBzipRunner(file["input"], file["output"], file["output_dir"])
-            sync_thread.setAutoDelete(True)
-            sync_thread.signals.thread_started.connect(self.sync_thread_started)
-            sync_thread.signals.thread_finished.connect(self.sync_thread_finished)
-            self.pool.start(sync_thread)
+        Each runner checks the core's pause and cancel state before it does any work
+        """
+        action, level = self.core.policy.rule_for(file["input"])
+        on_finished = self.runner_finished
+        if self.bzip_enabled and action == COMPRESS:
+            sync_thread = BzipRunner(file["source"], file["output"], file["output_dir"], compresslevel=level,
+                                     block_workers=self.block_workers, max_ratio=self.core.policy.max_ratio,
+                                     on_finished=on_finished, wait_to_run=self.core.wait_to_run,
+                                     retries=self.core.retries, cache_dir=self.core.cache_dir(),
+                                     digest=file["digest"], on_started=self.sync_thread_started)
+        else:
+            sync_thread = NonBzipRunner(file["source"], file["output"], file["output_dir"], on_finished=on_finished,
+                                        link=self.core.link_files, wait_to_run=self.core.wait_to_run,
+                                        retries=self.core.retries, on_started=self.sync_thread_started)
+        sync_thread.setAutoDelete(False)
+        self.runners.append((file, sync_thread))
+        self.core.progress.job_started()
+        self.pool.start(sync_thread)
+
+    def queue_event(self, event, *args):
+        """
+        Hold a per file event for the next batch.  A big sync has a few of these for every file, a queued signal for
+        each would flood the GUI's event loop.  The batch is sent every PROGRESS_INTERVAL, and before any other signal
+        so the GUI sees events in order.  Called from the sync thread and the pool threads
+        """
+        with self.events_lock:
+            self.events.append((event, args))
+            if time.time() - self.last_flush < PROGRESS_INTERVAL:
+                return
+        self.flush_events()
 
-    def sync_thread_started(self, message):
-        self.emit(SIGNAL('sync_thread_started(PyQt_PyObject)'), message)
+    def flush_events(self):
+        with self.events_lock:
+            events, self.events = self.events, []
+            self.last_flush = time.time()
+        if events:
+            self.emit(SIGNAL('sync_events(PyQt_PyObject)'), events)
 
-    def sync_thread_finished(self, message=""):
-        self.emit(SIGNAL('sync_thread_finished(PyQt_PyObject)'), message)
+    def file_queued(self, input_file):
+        self.queue_event("file_queued", input_file)
 
-    def update_active_threads(self):
-        while self.pool.activeThreadCount() > 0:
-            self.emit(SIGNAL('update_active_thread(PyQt_PyObject)'), self.pool.activeThreadCount())
-            self.sleep(0.2)
+    def newer_file_detected(self, input_file, rule):
+        self.queue_event("newer_file_detected", input_file, rule)
 
-        self.emit(SIGNAL('sync_completed'))
+    def file_removed(self, input_file, dry_run=False):
+        self.flush_events()
+        self.emit(SIGNAL('file_removed(PyQt_PyObject, PyQt_PyObject)'), input_file, dry_run)
 
-    def generate_output_paths(self, input_file):
-        """
-        Generate the relative and full output paths.  Return the output directory, the absolute output path and
-        relative game directory
-        :param input_file:
-        :return:
-        """
+    def stale_output_found(self, output_file, dry_run=False):
+        self.flush_events()
+        self.emit(SIGNAL('stale_output_found(PyQt_PyObject, PyQt_PyObject)'), output_file, dry_run)
 
-        relative_game_path = input_file.replace(self.input_directory + "\\", "") # Strip everything except game directories
+    def cleanup_completed(self, stats):
+        self.flush_events()
+        self.emit(SIGNAL('cleanup_completed(PyQt_PyObject)'), stats)
 
-        temp = os.path.join(self.output_dir, relative_game_path)
-        output_dir = os.path.dirname(temp)
-        output_file = os.path.join(output_dir, os.path.basename(input_file))
+    def scan_completed(self, stats):
+        self.flush_events()
+        self.emit(SIGNAL('scan_completed(PyQt_PyObject)'), stats)
 
-        if self.bzip_enabled:
-            output_file += ".bz2"
+    def set_progress_max(self, count):
+        self.flush_events()
+        self.emit(SIGNAL('set_progress_max(PyQt_PyObject)'), count)
 
-        return output_dir, output_file, relative_game_path
+    def sync_thread_started(self, message):
+        self.queue_event("sync_thread_started", message)
 
-    def check_exclude_list(self, to_be_checked):
-        """
-        Check if given file, or relative path is in exclude list.  If it's a file we also check it's extension against
-        exclude list
-        """
-        name, ext, relative_dir = "", "", ""
+    def progress_updated(self, finished, active):
+        self.flush_events()
+        self.emit(SIGNAL('progress_updated(PyQt_PyObject, PyQt_PyObject)'), finished, active)
 
-        # Check if it's a directory or file
-        if os.path.splitext(to_be_checked)[1]:
-            name, ext = os.path.splitext(os.path.split(to_be_checked)[1])
-            relative_dir = os.path.dirname(to_be_checked)
+    def file_synced(self, record):
+        self.queue_event("file_synced", record)
 
-        if to_be_checked in self.exclude_list:
-            return True
+    def file_failed(self, failure):
+        self.flush_events()
+        self.emit(SIGNAL('file_failed(PyQt_PyObject)'), failure)
 
-        if relative_dir and relative_dir in self.exclude_list:
-            return True
+    def sync_plan(self, plan):
+        self.flush_events()
+        self.emit(SIGNAL('sync_plan(PyQt_PyObject)'), plan)
 
-        if ext and ext in self.exclude_list:
-            return True
+    def sync_report(self, summary):
+        self.flush_events()
+        self.emit(SIGNAL('sync_report(PyQt_PyObject)'), summary)
 
-        return False
+    def sync_completed(self):
+        self.flush_events()
+        self.emit(SIGNAL('sync_completed'))
@@ -0,0 +1,194 @@
+import os
+import time
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from FastDL_Sync_Core import ENGINE_THREAD
+from FastDL_Sync_Index import INDEX_FILE_NAME
+
+# Seconds without any new events before a batch of changed files is synced.  Map uploads arrive as a burst of writes
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class PollingWatcher(object):
+    """
+    Detects changed files by comparing snapshots of the source tree's size and mtime.  Used where inotify isn't
+    available.  A snapshot walks the whole tree, so one is only taken every interval seconds
+    """
+
+    def __init__(self, source_dir, interval=DEFAULT_POLL_INTERVAL):
+        self.source_dir = source_dir
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+        self.next_snapshot = time.time() + interval
+
+    def take_snapshot(self):
+        snapshot = {}
+        for curdir, dirs, files in os.walk(self.source_dir):
+            for f in files:
+                path = os.path.join(curdir, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds and return the set of paths that were added, changed or removed.  Empty if the next
+        snapshot isn't due yet
+        """
+        wait = self.next_snapshot - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self.next_snapshot = time.time() + self.interval
+        snapshot = self.take_snapshot()
+
+        changed = set(path for path, stat in snapshot.items() if self.snapshot.get(path) != stat)
+        changed.update(path for path in self.snapshot if path not in snapshot)
+
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Detects changed files from inotify events.  Watches are added for every directory in the source tree, and for new
+    directories as they're created
+    """
+
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+        self.inotify = INotify()
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        self.watches = {}  # watch descriptor -> directory
+
+        for curdir, dirs, files in os.walk(source_dir):
+            self.add_watch(curdir)
+
+    def add_watch(self, directory):
+        try:
+            self.watches[self.inotify.add_watch(directory, self.mask)] = directory
+        except OSError:
+            pass
+
+    def remove_watches(self, directory):
+        """
+        Stop watching a directory that was moved away, and everything below it.  The watches would follow it
+        """
+        prefix = os.path.join(directory, "")
+        for wd, watched in list(self.watches.items()):
+            if watched == directory or watched.startswith(prefix):
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass
+                del self.watches[wd]
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds and return the set of paths that were added, changed or removed
+        """
+        changed = set()
+
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            directory = self.watches.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # A whole directory showed up.  Watch it and everything already inside it
+                    for curdir, dirs, files in os.walk(path):
+                        self.add_watch(curdir)
+                        changed.update(os.path.join(curdir, f) for f in files)
+                elif event.mask & (flags.MOVED_FROM | flags.DELETE):
+                    # Moving a directory out of the tree only sends this one event.  SyncCore.scan_paths() removes
+                    # everything indexed below it
+                    if event.mask & flags.MOVED_FROM:
+                        self.remove_watches(path)
+                    changed.add(path)
+                continue
+
+            # Files are picked up once they're closed after writing, not when they're created empty
+            if event.mask & flags.CREATE:
+                continue
+
+            changed.add(path)
+
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def create_watcher(source_dir, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Use inotify when the inotify_simple package is installed and we're on Linux, otherwise fall back to polling
+    """
+    if INotify is not None:
+        try:
+            return InotifyWatcher(source_dir)
+        except OSError:
+            pass
+    return PollingWatcher(source_dir, interval=poll_interval)
+
+
+class SyncWatcher(object):
+    """
+    Keeps FastDL in sync with the source directory by listening for filesystem events instead of walking the tree.
+
+    Changed paths are collected until no new events arrive for the debounce period, then only those files are run
+    through the SyncCore's compress and copy workers
+    """
+
+    def __init__(self, core, engine=ENGINE_THREAD, workers=1, debounce=DEFAULT_DEBOUNCE,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.core = core
+        self.engine = engine
+        self.workers = workers
+        self.debounce = debounce
+        self.watcher = create_watcher(core.input_directory, poll_interval)
+        self.running = False
+
+    def run(self):
+        self.running = True
+        pending = set()
+        last_event = 0
+
+        try:
+            while self.running:
+                # Skip the sync index, otherwise committing a batch would trigger the next one
+                changed = set(path for path in self.watcher.poll(self.debounce)
+                              if not os.path.basename(path).startswith(INDEX_FILE_NAME))
+                if changed:
+                    pending.update(changed)
+                    last_event = time.time()
+                    continue
+
+                if pending and time.time() - last_event >= self.debounce:
+                    self.sync_paths(pending)
+                    pending = set()
+        finally:
+            self.watcher.close()
+
+    def sync_paths(self, paths):
+        files_to_sync = self.core.scan_paths(paths)
+        if files_to_sync:
+            self.core.run_executor(self.engine, self.workers)
+        else:
+            self.core.finish_sync()
+
+    def stop(self):
+        self.running = False